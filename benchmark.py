@@ -0,0 +1,438 @@
+"""Benchmark các tầng xử lý của ứng dụng nhận diện biển báo
+
+Đo detect_traffic_signs, draw_popup_notifications, display_frame + show_frame và
+đường phát âm của speech_worker (speak_text -> hàng đợi -> lấy âm thanh -> bắt đầu
+phát, phần phát thật được thay bằng âm thanh độ dài 0) trên frame tổng hợp ở nhiều độ phân giải
+hoặc trên ảnh trong dataset/train.zip. Kết quả (p50/p95/p99, FPS, cấp phát bộ nhớ,
+RSS đỉnh) được in ra và lưu JSON để so sánh giữa các commit:
+
+    python benchmark.py --mock -o bench.json
+    python benchmark.py --mock --compare bench.json
+    python benchmark.py --source zip --model model/best.pt
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import types
+import tkinter as tk
+
+import cv2
+import numpy as np
+
+from main import (BACKENDS, CLASSES_VIE_FILE, CONF_THRESHOLD, DEFAULT_CALIBRATION_ZIP, MODEL_PATH,
+                  PREPROCESS_MODES, AudioCache, ChangeDetector, EngineResult, InferenceScheduler,
+                  SignCatalog, TrafficSignDetectionApp, iter_labeled_images, load_inference_model,
+                  read_classes_file)
+
+DEFAULT_RESOLUTIONS = '640x360,1280x720,1920x1080'
+STAGES = ('detect', 'popup', 'display', 'speech')
+
+class MockDetector:
+    """Mô hình giả cho phép đo không cần trọng số: box tất định, trôi dần theo frame
+
+    Trả về kết quả cùng giao diện result.boxes như ultralytics nên đi qua đúng các
+    call site của mô hình thật.
+    """
+
+    def __init__(self, names, num_signs=3, latency=0.0):
+        self.names = names
+        self.classes = list(names)[:num_signs]
+        self.latency = latency  # Giây, mô phỏng thời gian suy luận
+        self.calls = 0
+
+    def __call__(self, frames, conf=CONF_THRESHOLD, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        results = []
+        for frame in frames:
+            height, width = frame.shape[:2]
+            size = 0.08 * min(width, height)
+            detections = []
+            for i, cls_id in enumerate(self.classes):
+                x = (0.2 + 0.25 * i + 0.001 * self.calls) % 0.9 * width
+                y = (0.2 + 0.1 * i) * height
+                detections.append([x, y, x + size, y + size, 0.9, cls_id])
+            results.append(EngineResult(np.array(detections, dtype=np.float32).reshape(-1, 6)))
+            self.calls += 1
+        return results
+
+class NullWidget:
+    """Thay cho widget Tk khi không có màn hình"""
+
+    def config(self, **kwargs):
+        pass
+
+    configure = config
+
+    def destroy(self):
+        pass
+
+class NullRoot(NullWidget):
+    def title(self, *args):
+        pass
+
+    def geometry(self, *args):
+        pass
+
+    def after(self, *args):
+        pass
+
+class NullPhoto:
+    """Thay cho ImageTk.PhotoImage khi không có màn hình (paste không làm gì)"""
+
+    def __init__(self, size):
+        self.size = size
+
+    def width(self):
+        return self.size[0]
+
+    def height(self):
+        return self.size[1]
+
+    def paste(self, image):
+        pass
+
+class SilentChannel:
+    def get_busy(self):
+        return False
+
+class SilentSound:
+    """Âm thanh độ dài 0: phát xong ngay, không cần thiết bị âm thanh"""
+
+    def play(self):
+        return SilentChannel()
+
+    def stop(self):
+        pass
+
+class SilentAudioCache(AudioCache):
+    """Lấy mp3 (và giải mã nếu decode=True) như thật, chỉ thay phần phát bằng SilentSound"""
+
+    def __init__(self, decode=False, **kwargs):
+        super().__init__(**kwargs)
+        self.decode = decode
+
+    def get_sound(self, text):
+        if self.decode:
+            super().get_sound(text)
+        else:
+            self.get_mp3(text)
+        return SilentSound()
+
+class NullClock:
+    def tick(self, framerate=0):
+        return 0
+
+# Thay module pygame ở ranh giới phát âm thanh của speak_next
+SILENT_PYGAME = types.SimpleNamespace(time=types.SimpleNamespace(Clock=NullClock))
+
+class BenchmarkApp(TrafficSignDetectionApp):
+    """Ứng dụng không tải mô hình, không chạy luồng phát âm, dùng widget giả nếu không có Tk
+
+    Mô hình chạy ở mọi frame (không bỏ qua cảnh tĩnh, k=1) để tầng detect đo đúng
+    việc nhận diện, không phụ thuộc trạng thái của bộ lập lịch.
+    """
+
+    def __init__(self, root, model):
+        self.headless = isinstance(root, NullRoot)
+        super().__init__(root, change_detector=ChangeDetector(threshold=0))
+        self.scheduler = InferenceScheduler(max_interval=1)
+        self.model = model
+        self.catalog = SignCatalog(model.names)
+
+    def load_model(self):
+        pass
+
+    def speech_worker(self):
+        # Tầng speech tự gọi speak_next để đo, không chạy luồng phát âm
+        pass
+
+    def create_widgets(self):
+        if not self.headless:
+            return super().create_widgets()
+        for name in ('video_label', 'sign_images_container', 'overlay_panel', 'info_label',
+                     'status_indicator', 'status_label', 'fps_label'):
+            setattr(self, name, NullWidget())
+
+    def setup_styles(self):
+        if not self.headless:
+            super().setup_styles()
+
+    def update_sign_images_display(self):
+        if not self.headless:
+            super().update_sign_images_display()
+
+    def reset(self):
+        """Xóa trạng thái giữa các nguồn frame để các lần đo độc lập với nhau"""
+        self.stabilizer.clear()
+        self.scheduler.reset()
+        self.change_detector.reset()
+        self.last_detections = []
+        self.detected_history = []
+        for data in list(self.sign_images.values()) + self.crop_store.take_evicted():
+            if data.get('widget'):
+                data['widget'].destroy()
+        self.crop_store.clear()
+        self.sign_popup_text.clear()
+        self.photo = None
+
+def create_root():
+    """Cửa sổ Tk ẩn nếu có màn hình, nếu không thì dùng widget giả"""
+    try:
+        root = tk.Tk()
+        root.withdraw()
+        return root
+    except tk.TclError:
+        return NullRoot()
+
+def synthetic_frames(width, height, count=8, seed=0):
+    """Frame nhiễu tất định có dải trời/đường để thu nhỏ và nén giống video thật"""
+    rng = np.random.default_rng(seed)
+    frames = []
+    for i in range(count):
+        frame = rng.integers(0, 64, (height, width, 3), dtype=np.uint8)
+        frame[:height // 3] += np.uint8(120)
+        cv2.rectangle(frame, (i * width // count, height // 2),
+                      (i * width // count + width // 10, height // 2 + height // 10), (0, 0, 200), -1)
+        frames.append(frame)
+    return frames
+
+def load_sources(args):
+    """Danh sách (tên nguồn, danh sách frame)"""
+    sources = []
+    if args.source in ('synthetic', 'all'):
+        for spec in args.resolutions.split(','):
+            width, height = (int(v) for v in spec.lower().split('x'))
+            sources.append((f"synthetic {width}x{height}", synthetic_frames(width, height)))
+    if args.source in ('zip', 'all'):
+        images = [image for image, _ in iter_labeled_images(args.zip, args.zip_limit)]
+        if images:
+            sources.append((f"zip {args.zip}", images))
+        else:
+            print(f"Không có ảnh nào trong {args.zip}", file=sys.stderr)
+    return sources
+
+def summarize(latencies):
+    latencies = np.asarray(latencies) * 1000
+    return {
+        'n': int(latencies.size),
+        'mean_ms': float(latencies.mean()),
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'fps': float(1000 / latencies.mean()) if latencies.mean() > 0 else 0.0,
+    }
+
+def measure(step, iterations, alloc_iterations):
+    """Đo thời gian từng lần gọi step(i), rồi đo cấp phát bộ nhớ ở một lượt ngắn riêng
+
+    tracemalloc làm chậm đáng kể nên không bật trong lượt đo thời gian.
+    """
+    latencies = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        step(i)
+        latencies.append(time.perf_counter() - start)
+    stats = summarize(latencies)
+
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    for i in range(alloc_iterations):
+        step(iterations + i)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stats['alloc_peak_kb'] = (peak - base) / 1024
+    stats['alloc_net_kb'] = (current - base) / 1024
+    return stats
+
+def bench_detect(app, frames, args):
+    app.reset()
+    app.enable_sound = False  # Thông báo được đo riêng ở tầng speech
+    return measure(lambda i: app.detect_traffic_signs(frames[i % len(frames)]),
+                   args.iterations, args.alloc_iterations)
+
+def bench_popup(app, frames, args):
+    app.reset()
+    labels = list(app.model.names.values())[:args.popups]
+    for label in labels:
+        app.sign_popup_text[label] = {'text': app.catalog.get_by_label(label)['name'],
+                                      'first_stable': 0.0, 'last_seen': float('inf')}
+    fitted = [app.overlay.fit(frame) for frame in frames]
+    canvases = [img.copy() for img, _ in fitted]
+
+    def step(i):
+        k = i % len(frames)
+        # Khôi phục ảnh gốc trước mỗi lần vẽ (tính cả chi phí sao chép như lúc chạy thật)
+        np.copyto(canvases[k], fitted[k][0])
+        app.draw_popup_notifications(canvases[k], fitted[k][1], frames[k].shape[1])
+    return measure(step, args.iterations, args.alloc_iterations)
+
+def bench_display(app, frames, args):
+    app.reset()
+    app.is_video_active = True
+    fitted = [app.overlay.fit(frame)[0] for frame in frames]
+    if app.headless:
+        app.photo = NullPhoto((fitted[0].shape[1], fitted[0].shape[0]))
+
+    def step(i):
+        app.display_frame(fitted[i % len(fitted)])
+        # Phần việc của display_tick trên luồng chính
+        with app.display_lock:
+            frame, app.pending_frame = app.pending_frame, None
+        app.show_frame(frame)
+        app.ui.flush()
+    stats = measure(step, args.iterations, args.alloc_iterations)
+    app.is_video_active = False
+    return stats
+
+def bench_speech(app, frames, args):
+    """Từ speak_text qua hàng đợi ưu tiên và speak_next của luồng phát âm tới khi âm
+    thanh được phát (âm thanh độ dài 0, không tính thời gian đọc câu)"""
+    app.reset()
+    app.enable_sound = True
+    texts = app.catalog.announcements()[:args.popups]
+    decode = False
+    if not args.mock:
+        try:
+            import pygame
+            pygame.mixer.init()
+            decode = True
+        except Exception as e:
+            print(f"Không khởi tạo được pygame mixer, chỉ đo lấy mp3: {e}", file=sys.stderr)
+    real_cache = app.audio_cache
+    app.audio_cache = SilentAudioCache(decode=decode, cache_dir=real_cache.cache_dir)
+    if args.mock:
+        # Dữ liệu mp3 giả trong bộ nhớ: không gọi gTTS, không giải mã
+        for text in texts:
+            app.audio_cache.mp3_data[app.audio_cache._key(text)] = b'\0' * 4096
+
+    def step(i):
+        app.speak_text(texts[i % len(texts)])
+        app.speak_next(SILENT_PYGAME, timeout=0)
+    try:
+        return measure(step, args.iterations, args.alloc_iterations)
+    finally:
+        app.audio_cache = real_cache
+
+BENCHMARKS = {
+    'detect': bench_detect,
+    'popup': bench_popup,
+    'display': bench_display,
+    'speech': bench_speech,
+}
+
+def peak_rss_mb():
+    """RSS đỉnh của tiến trình (None trên Windows)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux trả về KB, macOS trả về byte
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+def compare_results(previous, results):
+    """In thay đổi p50/p95 so với file JSON của lần chạy trước"""
+    old = {(r['source'], r['stage']): r for r in previous.get('results', [])}
+    print(f"\nSo với {previous.get('meta', {}).get('commit') or 'lần trước'}:", file=sys.stderr)
+    for r in results:
+        before = old.get((r['source'], r['stage']))
+        if before is None:
+            continue
+        changes = [f"{key} {before[key]:.2f} -> {r[key]:.2f} ms "
+                   f"({(r[key] / before[key] - 1) * 100 if before[key] > 0 else 0.0:+.0f}%)"
+                   for key in ('p50_ms', 'p95_ms')]
+        print(f"  {r['source']:<28}{r['stage']:<9}{' | '.join(changes)}", file=sys.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark các tầng xử lý nhận diện biển báo")
+    parser.add_argument('--mock', action='store_true',
+                        help="Dùng mô hình giả tất định (không cần trọng số, không gọi gTTS)")
+    parser.add_argument('--mock-latency', type=float, default=0.0, metavar='MS',
+                        help="Độ trễ mô phỏng của mô hình giả (ms)")
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--backend', choices=BACKENDS, default='torch')
+    parser.add_argument('--preprocess', choices=PREPROCESS_MODES, default='ultralytics')
+    parser.add_argument('--source', choices=('synthetic', 'zip', 'all'), default='synthetic',
+                        help="Nguồn frame (mặc định: synthetic)")
+    parser.add_argument('--resolutions', default=DEFAULT_RESOLUTIONS,
+                        help=f"Độ phân giải frame tổng hợp (mặc định: {DEFAULT_RESOLUTIONS})")
+    parser.add_argument('--zip', default=DEFAULT_CALIBRATION_ZIP)
+    parser.add_argument('--zip-limit', type=int, default=50, help="Số ảnh tối đa lấy từ zip")
+    parser.add_argument('--stages', default=','.join(STAGES),
+                        help=f"Các tầng cần đo (mặc định: {','.join(STAGES)})")
+    parser.add_argument('--iterations', type=int, default=200, help="Số lần đo mỗi tầng")
+    parser.add_argument('--alloc-iterations', type=int, default=20,
+                        help="Số lần chạy khi đo cấp phát bộ nhớ bằng tracemalloc")
+    parser.add_argument('--popups', type=int, default=3, help="Số popup/câu thông báo đồng thời")
+    parser.add_argument('--output', '-o', metavar='FILE', help="Lưu kết quả JSON")
+    parser.add_argument('--compare', metavar='FILE', help="So sánh với kết quả JSON trước đó")
+    args = parser.parse_args()
+
+    stages = [stage for stage in args.stages.split(',') if stage]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"Tầng không hợp lệ: {', '.join(sorted(unknown))}")
+
+    if args.mock:
+        # Nhãn của mô hình thật là số thứ tự lớp ('0', '1', ...), cùng thứ tự với classes_vie.txt
+        num_classes = len(read_classes_file(CLASSES_VIE_FILE)) or 1
+        model = MockDetector({i: str(i) for i in range(num_classes)}, num_signs=args.popups, latency=args.mock_latency / 1000)
+    else:
+        model = load_inference_model(args.model, args.backend, preprocess=args.preprocess)
+    root = create_root()
+    app = BenchmarkApp(root, model)
+
+    sources = load_sources(args)
+    results = []
+    print(f"{'Nguồn':<28}{'Tầng':<9}{'p50':>8}{'p95':>8}{'p99':>8}{'FPS':>9}{'Peak KB':>10}",
+          file=sys.stderr)
+    for source, frames in sources:
+        for stage in stages:
+            stats = BENCHMARKS[stage](app, frames, args)
+            results.append({'source': source, 'stage': stage, **stats})
+            print(f"{source:<28}{stage:<9}{stats['p50_ms']:>8.2f}{stats['p95_ms']:>8.2f}"
+                  f"{stats['p99_ms']:>8.2f}{stats['fps']:>9.1f}{stats['alloc_peak_kb']:>10.0f}",
+                  file=sys.stderr)
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': np.__version__,
+            'opencv': cv2.__version__,
+            'tk': not app.headless,
+            'detector': 'mock' if args.mock else f"{args.model} ({args.backend}, {args.preprocess})",
+            'args': vars(args),
+        },
+        'peak_rss_mb': peak_rss_mb(),
+        'results': results,
+    }
+    print(f"RSS đỉnh: {report['peak_rss_mb'] or 0:.0f} MB", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare_results(json.load(f), results)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if not isinstance(root, NullRoot):
+        root.destroy()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,22 +1,2366 @@
 import tkinter as tk
-from tkinter import filedialog, messagebox
+from tkinter import filedialog, messagebox, simpledialog
 from tkinter import ttk
 import cv2
 from PIL import Image, ImageTk, ImageDraw, ImageFont
 import threading
-from ultralytics import YOLO
 import os
+import sys
+import json
+from datetime import datetime
+import argparse
+import multiprocessing
+import zipfile
 import unicodedata
 import time
 from collections import defaultdict
 import numpy as np
-from gtts import gTTS
 import io
-import pygame
-from queue import Queue
+import hashlib
+import bisect
+import sqlite3
+from queue import Queue, Empty, Full
+
+# Mốc thời gian khởi động (sau khi import các thư viện nhẹ)
+STARTUP_TIME = time.perf_counter()
+
+def import_yolo():
+    """Import ultralytics khi cần - chậm vì kéo theo torch nên không import ở đầu file"""
+    from ultralytics import YOLO
+    return YOLO
+
+# Tên và mô tả các metric xuất ra Prometheus
+METRIC_STAGE_SECONDS = 'traffic_sign_stage_seconds'
+METRIC_MODEL_LATENCY = 'traffic_sign_model_latency_seconds'
+METRIC_FRAMES = 'traffic_sign_frames_total'
+METRIC_DISPLAY_SKIPPED = 'traffic_sign_display_skipped_total'
+METRIC_SPEECH_QUEUE = 'traffic_sign_speech_queue_depth'
+METRIC_SPEECH_WAIT = 'traffic_sign_speech_wait_seconds'
+METRIC_SPEECH_DROPPED = 'traffic_sign_speech_dropped_total'
+METRIC_STABLE_EVENTS = 'traffic_sign_stable_events_total'
+METRIC_INFERENCE_INTERVAL = 'traffic_sign_inference_interval'
+METRIC_STREAM_AGE = 'traffic_sign_stream_frame_age_seconds'
+METRIC_STREAM_LATENCY = 'traffic_sign_stream_latency_seconds'
+METRIC_STREAM_RECONNECTS = 'traffic_sign_stream_reconnects_total'
+METRIC_DESCRIPTIONS = {
+    METRIC_STAGE_SECONDS: ('histogram', "Thời gian từng tầng xử lý một frame "
+                                        "(capture, inference, postprocess, overlay, display)"),
+    METRIC_MODEL_LATENCY: ('histogram', "Độ trễ của mô hình ở các frame thực sự chạy nhận diện"),
+    METRIC_FRAMES: ('counter', "Số frame qua pipeline theo sự kiện (captured, processed, rendered, "
+                               "dropped_capture, dropped_render, dropped_late)"),
+    METRIC_DISPLAY_SKIPPED: ('counter', "Số frame bị thay bởi frame mới hơn trước khi kịp hiển thị"),
+    METRIC_SPEECH_QUEUE: ('gauge', "Số câu thông báo đang chờ phát"),
+    METRIC_SPEECH_WAIT: ('histogram', "Thời gian câu thông báo chờ trong hàng đợi trước khi phát"),
+    METRIC_SPEECH_DROPPED: ('counter', "Số câu thông báo không được phát hết theo lý do "
+                                       "(coalesced, expired, preempted)"),
+    METRIC_STABLE_EVENTS: ('counter', "Số biển báo ổn định mới theo lớp"),
+    METRIC_INFERENCE_INTERVAL: ('gauge', "Chạy mô hình mỗi k frame"),
+    METRIC_STREAM_AGE: ('gauge', "Thời gian từ lúc nhận frame mới nhất của luồng mạng"),
+    METRIC_STREAM_LATENCY: ('gauge', "Độ trễ từ lúc nhận frame tới lúc được xử lý (EMA)"),
+    METRIC_STREAM_RECONNECTS: ('counter', "Số lần kết nối lại luồng mạng"),
+}
+# Bucket (giây) cho histogram độ trễ
+METRIC_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+class MetricsRegistry:
+    """Counter, gauge và histogram tối giản, xuất dạng text của Prometheus
+    
+    Khi enabled=False các hàm ghi trả về ngay nên gần như không tốn chi phí. Giá trị
+    chỉ cần lúc scrape (vd: độ dài hàng đợi) được tính bằng hàm đăng ký qua add_collector.
+    """
+
+    def __init__(self, enabled=False, buckets=METRIC_BUCKETS):
+        self.enabled = enabled
+        self.buckets = buckets
+        self.descriptions = dict(METRIC_DESCRIPTIONS)
+        self.lock = threading.Lock()
+        self.values = {}  # (tên, nhãn) -> số, hoặc [đếm theo bucket, tổng, số lần] với histogram
+        self.collectors = []
+        self.server = None
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.values[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, value, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            histogram = self.values.get(key)
+            if histogram is None:
+                histogram = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def add_collector(self, collector):
+        """Đăng ký hàm được gọi trước mỗi lần scrape để cập nhật gauge"""
+        self.collectors.append(collector)
+
+    @staticmethod
+    def _format_labels(labels):
+        if not labels:
+            return ''
+        escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+                   for _, value in labels)
+        return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+    def render(self):
+        """Toàn bộ metric dạng text exposition của Prometheus"""
+        for collector in self.collectors:
+            try:
+                collector()
+            except Exception as e:
+                print(f"Lỗi khi thu thập metric: {e}")
+        with self.lock:
+            items = sorted((key, [list(value[0]), value[1], value[2]] if isinstance(value, list) else value)
+                           for key, value in self.values.items())
+        
+        lines = []
+        described = set()
+        for (name, labels), value in items:
+            kind, help_text = self.descriptions.get(name, ('untyped', name))
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+            if kind != 'histogram':
+                lines.append(f"{name}{self._format_labels(labels)} {value}")
+                continue
+            counts, total, count = value
+            cumulative = 0
+            for bound, n in zip(self.buckets + (None,), counts):
+                cumulative += n
+                le = '+Inf' if bound is None else f"{bound:g}"
+                lines.append(f"{name}_bucket{self._format_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{name}_sum{self._format_labels(labels)} {total}")
+            lines.append(f"{name}_count{self._format_labels(labels)} {count}")
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port, host='127.0.0.1'):
+        """Phục vụ /metrics qua HTTP ở luồng nền (chỉ nghe trên máy local mặc định)"""
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        registry = self
+        
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self, format, *args):
+                pass  # Không in log mỗi lần scrape
+        
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=self.server.serve_forever, name="metrics-http", daemon=True).start()
+        print(f"Metrics Prometheus: http://{host}:{port}/metrics")
+        return self.server
+
+# Chính sách bỏ frame của pipeline
+DROP_LATEST = 'latest'      # Camera: chỉ giữ frame mới nhất, bỏ frame cũ
+DROP_LOSSLESS = 'lossless'  # Video file: không bỏ frame nào
+
+class FramePipeline:
+    """Pipeline 3 tầng capture -> inference -> render nối bằng hàng đợi có giới hạn"""
+
+    _END = object()  # Đánh dấu hết nguồn frame
+
+    def __init__(self, read_frame, process_frame, render_frame,
+                 drop_policy=DROP_LATEST, queue_size=1,
+                 is_active=None, is_paused=None, clock=None, frame_time=None,
+                 on_finish=None, name="pipeline", metrics=None):
+        self.read_frame = read_frame          # () -> (ret, frame)
+        self.process_frame = process_frame    # frame -> frame đã nhận diện
+        self.render_frame = render_frame      # frame -> None
+        self.drop_policy = drop_policy
+        self.is_active = is_active or (lambda: True)
+        self.is_paused = is_paused or (lambda: False)
+        self.clock = clock                    # PlaybackClock giữ nhịp phát (video file)
+        self.frame_time = frame_time          # () -> thời điểm trong video của frame vừa đọc
+        self.current_media_time = None        # Thời điểm trong video của frame đang nhận diện
+        self.on_finish = on_finish
+        self.name = name
+        self.metrics = metrics or MetricsRegistry()
+
+        self.capture_queue = Queue(maxsize=queue_size)
+        self.render_queue = Queue(maxsize=queue_size)
+
+        self.running = False
+        self.threads = []
+        self.stats_lock = threading.Lock()
+        self.stats = {
+            'captured': 0,
+            'processed': 0,
+            'rendered': 0,
+            'dropped_capture': 0,
+            'dropped_render': 0,
+            'dropped_late': 0,
+        }
+
+    def start(self):
+        """Khởi động 3 luồng capture, inference, render"""
+        self.running = True
+        self.threads = [
+            threading.Thread(target=self._capture_stage, name=f"{self.name}-capture", daemon=True),
+            threading.Thread(target=self._inference_stage, name=f"{self.name}-inference", daemon=True),
+            threading.Thread(target=self._render_stage, name=f"{self.name}-render", daemon=True),
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        """Yêu cầu dừng tất cả các tầng"""
+        self.running = False
+
+    def join(self, timeout=None):
+        for thread in self.threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout)
+
+    def get_stats(self):
+        """Trả về bản sao bộ đếm frame (đã xử lý, đã bỏ...)"""
+        with self.stats_lock:
+            stats = dict(self.stats)
+        stats['dropped'] = stats['dropped_capture'] + stats['dropped_render'] + stats['dropped_late']
+        return stats
+
+    def _count(self, key, n=1):
+        with self.stats_lock:
+            self.stats[key] += n
+        self.metrics.inc(METRIC_FRAMES, n, pipeline=self.name, event=key)
+
+    def _alive(self):
+        return self.running and self.is_active()
+
+    def _put(self, q, item, drop_key):
+        """Đưa item vào hàng đợi theo chính sách bỏ frame"""
+        if self.drop_policy == DROP_LATEST and item is not self._END:
+            while True:
+                try:
+                    q.put_nowait(item)
+                    return True
+                except Full:
+                    # Bỏ frame cũ nhất để nhường chỗ cho frame mới
+                    try:
+                        q.get_nowait()
+                        self._count(drop_key)
+                    except Empty:
+                        pass
+
+        while self._alive() or item is self._END:
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except Full:
+                if not self._alive():
+                    # Đang dừng: dọn hàng đợi để chắc chắn đặt được _END
+                    try:
+                        q.get_nowait()
+                    except Empty:
+                        pass
+        return False
+
+    def _get(self, q):
+        """Lấy item từ hàng đợi, trả về _END khi pipeline dừng"""
+        while True:
+            try:
+                return q.get(timeout=0.1)
+            except Empty:
+                if not self._alive():
+                    return self._END
+
+    def _capture_stage(self):
+        try:
+            while self._alive():
+                if self.is_paused():
+                    time.sleep(0.1)
+                    continue
+                start = time.perf_counter()
+                ret, frame = self.read_frame()
+                if not ret:
+                    break
+                self.metrics.observe(METRIC_STAGE_SECONDS, time.perf_counter() - start, stage='capture')
+                self._count('captured')
+                media_time = self.frame_time() if self.frame_time else None
+                self._put(self.capture_queue, (frame, media_time), 'dropped_capture')
+        except Exception as e:
+            print(f"Lỗi tầng capture ({self.name}): {e}")
+        finally:
+            self._put(self.capture_queue, self._END, 'dropped_capture')
+
+    def _inference_stage(self):
+        try:
+            while True:
+                item = self._get(self.capture_queue)
+                if item is self._END:
+                    break
+                frame, media_time = item
+                if (self.clock is not None and media_time is not None
+                        and self.clock.is_behind(media_time)):
+                    # Frame đã trễ lịch trong lúc chờ ở hàng đợi: bỏ trước khi nhận diện
+                    self._count('dropped_late')
+                    continue
+                self.current_media_time = media_time
+                result = self.process_frame(frame)
+                self._count('processed')
+                self._put(self.render_queue, (result, media_time), 'dropped_render')
+        except Exception as e:
+            print(f"Lỗi tầng inference ({self.name}): {e}")
+        finally:
+            self._put(self.render_queue, self._END, 'dropped_render')
+
+    def _render_stage(self):
+        try:
+            while True:
+                item = self._get(self.render_queue)
+                if item is self._END:
+                    break
+                frame, media_time = item
+                # Video file: chờ tới thời điểm frame cần lên màn hình, trễ thì hiện ngay
+                if self.clock is not None and media_time is not None:
+                    wait = self.clock.due_time(media_time) - time.perf_counter()
+                    if wait > 0:
+                        time.sleep(wait)
+                self.render_frame(frame)
+                if self.clock is not None and media_time is not None:
+                    self.clock.on_shown(media_time)
+                self._count('rendered')
+        except Exception as e:
+            print(f"Lỗi tầng render ({self.name}): {e}")
+        finally:
+            self.running = False
+            stats = self.get_stats()
+            print(f"[{self.name}] Đã xử lý: {stats['processed']} frame, "
+                  f"đã bỏ: {stats['dropped']} frame")
+            if self.on_finish:
+                self.on_finish()
+
+class UiDispatcher:
+    """Gom cập nhật giao diện từ các luồng worker, áp dụng trên luồng chính của Tk
+    
+    Worker chỉ gửi trạng thái mới nhất theo từng khóa (dòng thông báo, log...), không
+    gọi Tk. Luồng chính gọi flush() theo nhịp cố định: mỗi khóa được vẽ lại tối đa một
+    lần cho mọi lần gửi trong khoảng đó, và bỏ qua nếu nội dung không đổi so với lần
+    vẽ trước.
+    """
+
+    _MISSING = object()
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.renderers = {}  # khóa -> hàm vẽ (chạy trên luồng chính)
+        self.pending = {}
+        self.applied = {}
+        self.stats = {'posted': 0, 'coalesced': 0, 'unchanged': 0, 'applied': 0}
+
+    def register(self, key, render):
+        self.renderers[key] = render
+
+    def post(self, key, value):
+        """Gửi trạng thái mới của khóa (gọi được từ mọi luồng); value phải so sánh được bằng =="""
+        with self.lock:
+            if key in self.pending:
+                self.stats['coalesced'] += 1
+            self.pending[key] = value
+            self.stats['posted'] += 1
+
+    def flush(self):
+        """Vẽ các khóa có nội dung thay đổi (chỉ gọi từ luồng chính)"""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        for key, value in pending.items():
+            if self.applied.get(key, self._MISSING) == value:
+                self.stats['unchanged'] += 1
+                continue
+            self.applied[key] = value
+            try:
+                self.renderers[key](value)
+                self.stats['applied'] += 1
+            except Exception as e:
+                print(f"Lỗi cập nhật giao diện ({key}): {e}")
+
+MODEL_PATH = 'model/best.pt'
+CONF_THRESHOLD = 0.7  # Chỉ giữ biển báo có độ tin cậy cao
+
+def read_classes_file(file_path):
+    """Đọc file classes_vie.txt và trả về danh sách các lớp"""
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            classes_vie = [line.strip() for line in f if line.strip()]
+        return classes_vie
+    except FileNotFoundError:
+        print(f"Không tìm thấy file: {file_path}")
+        return []
+    except Exception as e:
+        print(f"Lỗi khi đọc file {file_path}: {e}")
+        return []
+
+def predict_detections(model, frames, conf=CONF_THRESHOLD, imgsz=None):
+    """Chạy mô hình trên danh sách frame, trả về danh sách detection cho từng frame"""
+    if imgsz:
+        results = model(frames, conf=conf, imgsz=imgsz, verbose=False)
+    else:
+        results = model(frames, conf=conf, verbose=False)
+    all_detections = []
+    for result in results:
+        boxes = result.boxes
+        detections = []
+        for xyxy, cls_id, score in zip(boxes.xyxy.tolist(), boxes.cls.tolist(), boxes.conf.tolist()):
+            cls_id = int(cls_id)
+            detections.append({
+                'box': tuple(xyxy),
+                'cls_id': cls_id,
+                'label': model.names.get(cls_id, f"cls_{cls_id}"),
+                'conf': float(score),
+            })
+        all_detections.append(detections)
+    return all_detections
+
+def box_iou(boxes_a, boxes_b):
+    """Ma trận IoU giữa 2 tập box (N, 4) và (M, 4) dạng x1, y1, x2, y2"""
+    boxes_a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    boxes_b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+    tl = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    br = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    inter = np.prod(np.clip(br - tl, 0, None), axis=2)
+    area_a = np.prod(boxes_a[:, 2:] - boxes_a[:, :2], axis=1)
+    area_b = np.prod(boxes_b[:, 2:] - boxes_b[:, :2], axis=1)
+    union = area_a[:, None] + area_b[None, :] - inter
+    return inter / np.maximum(union, 1e-6)
+
+def box_ios(boxes_a, boxes_b):
+    """Ma trận diện tích giao / diện tích box nhỏ hơn giữa 2 tập box (N, 4) và (M, 4)"""
+    boxes_a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    boxes_b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+    tl = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    br = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    inter = np.prod(np.clip(br - tl, 0, None), axis=2)
+    area_a = np.prod(boxes_a[:, 2:] - boxes_a[:, :2], axis=1)
+    area_b = np.prod(boxes_b[:, 2:] - boxes_b[:, :2], axis=1)
+    return inter / np.maximum(np.minimum(area_a[:, None], area_b[None, :]), 1e-6)
+
+def merge_region_detections(detections, ios_threshold=0.5):
+    """Gộp box cùng lớp từ các vùng/ô chồng lấn
+    
+    Biển báo nằm trên đường cắt giữa 2 ô cho ra một box đầy đủ và một mảnh; IoU của
+    chúng thấp nên NMS thường giữ cả hai. Ở đây các box cùng lớp có phần giao chiếm
+    hơn ios_threshold diện tích box nhỏ hơn được gộp thành hộp bao chung, giữ lớp và
+    độ tin cậy của box tin cậy nhất.
+    """
+    if len(detections) < 2:
+        return detections
+    boxes = np.array([det['box'] for det in detections], dtype=np.float32)
+    scores = np.array([det['conf'] for det in detections], dtype=np.float32)
+    classes = np.array([det['cls_id'] for det in detections])
+    
+    merged = []
+    used = np.zeros(len(detections), dtype=bool)
+    for i in np.argsort(-scores):
+        if used[i]:
+            continue
+        used[i] = True
+        box = boxes[i].copy()
+        # Lặp tới khi hộp bao không nhận thêm box nào (mảnh ở 2 phía của biển báo)
+        while True:
+            candidates = np.nonzero(~used & (classes == classes[i]))[0]
+            if not len(candidates):
+                break
+            added = candidates[box_ios(box, boxes[candidates])[0] > ios_threshold]
+            if not len(added):
+                break
+            used[added] = True
+            box[:2] = np.minimum(box[:2], boxes[added, :2].min(axis=0))
+            box[2:] = np.maximum(box[2:], boxes[added, 2:].max(axis=0))
+        det = dict(detections[i])
+        det['box'] = tuple(float(v) for v in box)
+        merged.append((i, det))
+    return [det for _, det in sorted(merged, key=lambda item: item[0])]
+
+# Kích thước ảnh lúc huấn luyện (runs_train/traffic_sign_vn/args.yaml)
+TRAIN_IMGSZ = 512
+
+# Vùng quan tâm cho dashcam (tỉ lệ theo khung hình): dải phía trên và lề đường bên phải
+ROI_PRESETS = {
+    'dashcam': [(0.0, 0.0, 1.0, 0.4), (0.5, 0.2, 1.0, 0.75)],
+}
+
+class TiledInference:
+    """Nhận diện trên toàn khung hình, trên các vùng quan tâm (ROI) hoặc trên lưới ô chồng lấn
+    
+    Với ROI/ô, mỗi vùng được cắt ra (không sao chép) và đưa vào mô hình ở kích thước
+    huấn luyện nên biển báo nhỏ ở xa không bị thu nhỏ thêm như khi đưa cả frame 1080p
+    vào mô hình. Box được đưa về tọa độ frame rồi gộp giữa các vùng theo phần giao trên
+    box nhỏ hơn, để mảnh biển báo bị cắt ở mép ô không thành box riêng.
+    """
+
+    def __init__(self, rois=None, tile_size=None, overlap=0.2, imgsz=TRAIN_IMGSZ):
+        self.rois = rois            # Danh sách (x1, y1, x2, y2) theo tỉ lệ khung hình
+        self.tile_size = tile_size  # Cạnh ô vuông (pixel)
+        self.overlap = overlap
+        self.imgsz = imgsz
+        self.pixels = 0       # Tổng số pixel đã đưa vào mô hình
+        self.seconds = 0.0    # Tổng thời gian nhận diện
+        self.frames = 0
+
+    @classmethod
+    def from_spec(cls, roi=None, tile_size=None, overlap=0.2):
+        """Tạo từ tham số dòng lệnh: roi là tên preset hoặc 'x1,y1,x2,y2;...'"""
+        rois = None
+        if roi:
+            if roi in ROI_PRESETS:
+                rois = ROI_PRESETS[roi]
+            else:
+                rois = [tuple(float(v) for v in part.split(','))
+                        for part in roi.split(';') if part.strip()]
+                if any(len(r) != 4 for r in rois):
+                    raise ValueError(f"ROI không hợp lệ: {roi}")
+        return cls(rois=rois, tile_size=tile_size, overlap=overlap)
+
+    @property
+    def mode(self):
+        if self.rois:
+            return 'roi'
+        if self.tile_size:
+            return 'tiles'
+        return 'full'
+
+    def _tile_starts(self, length):
+        if length <= self.tile_size:
+            return [0]
+        step = max(1, int(self.tile_size * (1 - self.overlap)))
+        starts = list(range(0, length - self.tile_size, step))
+        starts.append(length - self.tile_size)
+        return starts
+
+    def regions(self, width, height):
+        """Danh sách vùng (x1, y1, x2, y2) theo pixel cho frame kích thước width x height"""
+        if self.rois:
+            return [(int(x1 * width), int(y1 * height), int(x2 * width), int(y2 * height))
+                    for x1, y1, x2, y2 in self.rois]
+        if self.tile_size:
+            return [(x, y, min(width, x + self.tile_size), min(height, y + self.tile_size))
+                    for y in self._tile_starts(height) for x in self._tile_starts(width)]
+        return [(0, 0, width, height)]
+
+    def predict(self, model, frames, conf=CONF_THRESHOLD):
+        """Nhận diện trên danh sách frame, trả về danh sách detection theo tọa độ frame"""
+        start = time.perf_counter()
+        if self.mode == 'full':
+            all_detections = predict_detections(model, frames, conf)
+            self.pixels += sum(frame.shape[0] * frame.shape[1] for frame in frames)
+        else:
+            crops = []
+            owners = []  # (chỉ số frame, x lệch, y lệch) cho từng vùng
+            for i, frame in enumerate(frames):
+                height, width = frame.shape[:2]
+                for x1, y1, x2, y2 in self.regions(width, height):
+                    crops.append(frame[y1:y2, x1:x2])
+                    owners.append((i, x1, y1))
+                    self.pixels += (x2 - x1) * (y2 - y1)
+            
+            merged = [[] for _ in frames]
+            for (i, dx, dy), detections in zip(owners, predict_detections(model, crops, conf,
+                                                                          self.imgsz)):
+                for det in detections:
+                    x1, y1, x2, y2 = det['box']
+                    det['box'] = (x1 + dx, y1 + dy, x2 + dx, y2 + dy)
+                    merged[i].append(det)
+            all_detections = [merge_region_detections(detections) for detections in merged]
+        
+        self.seconds += time.perf_counter() - start
+        self.frames += len(frames)
+        return all_detections
+
+    def pixels_per_second(self):
+        return self.pixels / self.seconds if self.seconds > 0 else 0.0
+
+    def summary(self):
+        return (f"chế độ {self.mode}: {self.pixels / max(1, self.frames) / 1e6:.2f} MP/frame, "
+                f"{self.pixels_per_second() / 1e6:.1f} MP/s")
+
+def iter_labeled_images(zip_path, limit=None):
+    """Đọc ảnh và nhãn YOLO trong file zip (images/*.jpg + labels/*.txt)
+    
+    Trả về lần lượt (ảnh BGR, danh sách (class id, box x1, y1, x2, y2 theo pixel)).
+    """
+    count = 0
+    with zipfile.ZipFile(zip_path) as archive:
+        names = set(archive.namelist())
+        for name in sorted(names):
+            if limit is not None and count >= limit:
+                break
+            if not name.startswith('images/') or name.endswith('/'):
+                continue
+            label_name = 'labels/' + os.path.splitext(os.path.basename(name))[0] + '.txt'
+            if label_name not in names:
+                continue
+            image = cv2.imdecode(np.frombuffer(archive.read(name), np.uint8), cv2.IMREAD_COLOR)
+            if image is None:
+                continue
+            height, width = image.shape[:2]
+            truths = []
+            for line in archive.read(label_name).decode('utf-8').splitlines():
+                parts = line.split()
+                if len(parts) < 5:
+                    continue
+                cls_id, cx, cy, w, h = int(parts[0]), *map(float, parts[1:5])
+                truths.append((cls_id, ((cx - w / 2) * width, (cy - h / 2) * height,
+                                        (cx + w / 2) * width, (cy + h / 2) * height)))
+            count += 1
+            yield image, truths
+
+def evaluate_recall(model, tiling, zip_path, iou_threshold=0.5):
+    """Đo recall trên ảnh có nhãn YOLO trong file zip"""
+    total = 0
+    found = 0
+    for image, truths in iter_labeled_images(zip_path):
+        detections = tiling.predict(model, [image])[0]
+        total += len(truths)
+        for cls_id, box in truths:
+            boxes = [det['box'] for det in detections if det['cls_id'] == cls_id]
+            if boxes and box_iou([box], boxes).max() >= iou_threshold:
+                found += 1
+    return found / total if total else 0.0
+
+def compare_tiling(zip_path, tiling, model_path=MODEL_PATH, backend='torch', preprocess='ultralytics'):
+    """In recall và MP/s của toàn khung hình so với chế độ ROI/ô đã chọn"""
+    model = load_inference_model(model_path, backend, preprocess=preprocess)
+    modes = [TiledInference()]
+    if tiling.mode != 'full':
+        modes.append(tiling)
+    for mode in modes:
+        recall = evaluate_recall(model, mode, zip_path)
+        print(f"Recall {recall:.3f} | {mode.summary()}", file=sys.stderr)
+    return 0
+
+DEFAULT_CALIBRATION_ZIP = 'dataset/train.zip'
+BACKENDS = ('torch', 'onnx', 'onnx-int8', 'openvino')
+
+def letterbox_geometry(height, width, imgsz):
+    """Tỉ lệ thu nhỏ, kích thước sau resize và lề khi letterbox ảnh height x width về imgsz"""
+    ratio = min(imgsz / height, imgsz / width)
+    new_w, new_h = int(round(width * ratio)), int(round(height * ratio))
+    return ratio, new_w, new_h, (imgsz - new_w) // 2, (imgsz - new_h) // 2
+
+def letterbox(image, imgsz, color=(114, 114, 114)):
+    """Thu nhỏ giữ tỉ lệ và thêm viền để được ảnh imgsz x imgsz (giống ultralytics)
+    
+    Trả về (ảnh, tỉ lệ, (lề trái, lề trên)).
+    """
+    ratio, new_w, new_h, pad_x, pad_y = letterbox_geometry(*image.shape[:2], imgsz)
+    resized = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    padded = cv2.copyMakeBorder(resized, pad_y, imgsz - new_h - pad_y, pad_x, imgsz - new_w - pad_x,
+                                cv2.BORDER_CONSTANT, value=color)
+    return padded, ratio, (pad_x, pad_y)
+
+class ExportedModel:
+    """Bọc mô hình đã export (ONNX/OpenVINO) để dùng chung call site với mô hình PyTorch
+    
+    Mô hình export với kích thước động nên luôn truyền imgsz huấn luyện khi gọi.
+    """
+
+    def __init__(self, model, backend, imgsz=TRAIN_IMGSZ):
+        self.model = model
+        self.backend = backend
+        self.imgsz = imgsz
+        self.names = model.names
+
+    def __call__(self, frames, **kwargs):
+        kwargs.setdefault('imgsz', self.imgsz)
+        return self.model(frames, **kwargs)
+
+def _is_outdated(path, source_path):
+    return not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(source_path)
+
+def export_onnx(model_path):
+    """Export trọng số PyTorch sang ONNX (kích thước động), bỏ qua nếu đã có bản mới"""
+    onnx_path = os.path.splitext(model_path)[0] + '.onnx'
+    if _is_outdated(onnx_path, model_path):
+        print(f"Đang export {model_path} sang ONNX...")
+        onnx_path = import_yolo()(model_path).export(format='onnx', imgsz=TRAIN_IMGSZ, dynamic=True,
+                                            simplify=True)
+    return onnx_path
+
+def export_openvino(model_path):
+    """Export trọng số PyTorch sang OpenVINO IR, bỏ qua nếu đã có bản mới"""
+    openvino_dir = os.path.splitext(model_path)[0] + '_openvino_model'
+    xml_path = os.path.join(openvino_dir, os.path.basename(os.path.splitext(model_path)[0]) + '.xml')
+    if _is_outdated(xml_path, model_path):
+        print(f"Đang export {model_path} sang OpenVINO...")
+        openvino_dir = import_yolo()(model_path).export(format='openvino', imgsz=TRAIN_IMGSZ, dynamic=True)
+    return openvino_dir
+
+def quantize_onnx_int8(onnx_path, calibration_zip=DEFAULT_CALIBRATION_ZIP, num_images=100):
+    """Lượng tử hóa tĩnh INT8 mô hình ONNX, hiệu chỉnh bằng ảnh trong dataset/train.zip"""
+    int8_path = os.path.splitext(onnx_path)[0] + '_int8.onnx'
+    if not _is_outdated(int8_path, onnx_path):
+        return int8_path
+    
+    import onnxruntime
+    from onnxruntime.quantization import (CalibrationDataReader, QuantFormat, QuantType,
+                                          quantize_static)
+    
+    input_name = onnxruntime.InferenceSession(
+        onnx_path, providers=['CPUExecutionProvider']).get_inputs()[0].name
+    
+    class ZipCalibrationReader(CalibrationDataReader):
+        """Đưa ảnh hiệu chỉnh đã letterbox + chuẩn hóa giống lúc suy luận"""
+        def __init__(self):
+            self.samples = iter(iter_labeled_images(calibration_zip, num_images))
+        
+        def get_next(self):
+            sample = next(self.samples, None)
+            if sample is None:
+                return None
+            padded = letterbox(sample[0], TRAIN_IMGSZ)[0]
+            blob = cv2.dnn.blobFromImage(padded, 1 / 255.0, swapRB=True)
+            return {input_name: blob}
+    
+    print(f"Đang lượng tử hóa INT8 {onnx_path} với ảnh từ {calibration_zip}...")
+    quantize_static(onnx_path, int8_path, ZipCalibrationReader(),
+                    quant_format=QuantFormat.QDQ,
+                    activation_type=QuantType.QUInt8,
+                    weight_type=QuantType.QInt8,
+                    per_channel=True)
+    return int8_path
+
+PREPROCESS_MODES = ('ultralytics', 'buffers')
+
+def import_nms():
+    """Hàm NMS của ultralytics (module chứa hàm này đổi chỗ giữa các phiên bản)"""
+    try:
+        from ultralytics.utils.nms import non_max_suppression
+    except ImportError:
+        from ultralytics.utils.ops import non_max_suppression
+    return non_max_suppression
+
+class EngineResult:
+    """Kết quả tối giản có cùng giao diện result.boxes.xyxy/cls/conf như ultralytics"""
+
+    def __init__(self, detections):
+        self.boxes = self
+        self.xyxy = detections[:, :4]
+        self.conf = detections[:, 4]
+        self.cls = detections[:, 5]
+
+class PreprocessEngine:
+    """Letterbox + chuẩn hóa vào bộ đệm dựng sẵn rồi gọi thẳng mạng (PyTorch hoặc ONNX)
+    
+    Thay cho tiền xử lý của ultralytics vốn cấp phát mảng và tensor mới cho mỗi frame:
+    ảnh được resize vào bộ đệm theo kích thước, rồi đổi BGR->RGB, HWC->CHW và chia 255
+    trong một phép ghi thẳng vào vùng giữa của tensor float32 đầu vào. Viền xám chỉ
+    được tô lại khi kích thước ảnh thay đổi. Box sau NMS được đưa về tọa độ ảnh gốc
+    ngay trên tensor kết quả.
+    """
+
+    def __init__(self, model, backend='torch', onnx_path=None, imgsz=TRAIN_IMGSZ, iou=0.7, max_det=300):
+        import torch
+        self.torch = torch
+        self.nms = import_nms()
+        self.names = model.names
+        self.backend = backend
+        self.imgsz = imgsz
+        self.iou = iou          # Giống mặc định của ultralytics khi predict
+        self.max_det = max_det
+        self.scale = np.float32(1 / 255.0)
+        self.pad_value = np.float32(114 / 255.0)
+        self.blob = np.zeros((0, 3, imgsz, imgsz), dtype=np.float32)
+        self.geometry = []      # Letterbox hiện tại của từng vị trí trong blob
+        self.resized = {}       # (rộng, cao) -> bộ đệm ảnh sau resize
+        
+        if onnx_path:
+            import onnxruntime
+            self.session = onnxruntime.InferenceSession(onnx_path, providers=['CPUExecutionProvider'])
+            self.input_name = self.session.get_inputs()[0].name
+            self.net = None
+        else:
+            self.session = None
+            self.net = model.model.float().fuse(verbose=False).eval()
+
+    def _reserve(self, batch_size):
+        if self.blob.shape[0] < batch_size:
+            self.blob = np.full((batch_size, 3, self.imgsz, self.imgsz), self.pad_value,
+                                dtype=np.float32)
+            self.geometry = [None] * batch_size
+
+    def prepare(self, frames):
+        """Ghi các frame vào blob, trả về letterbox (tỉ lệ, lề trái, lề trên) của từng frame"""
+        self._reserve(len(frames))
+        letterboxes = []
+        for i, frame in enumerate(frames):
+            height, width = frame.shape[:2]
+            ratio, new_w, new_h, pad_x, pad_y = letterbox_geometry(height, width, self.imgsz)
+            slot = self.blob[i]
+            if self.geometry[i] != (new_w, new_h, pad_x, pad_y):
+                slot.fill(self.pad_value)
+                self.geometry[i] = (new_w, new_h, pad_x, pad_y)
+            
+            if (new_w, new_h) != (width, height):
+                buffer = self.resized.get((new_w, new_h))
+                if buffer is None:
+                    buffer = self.resized[(new_w, new_h)] = np.empty((new_h, new_w, 3), dtype=np.uint8)
+                frame = cv2.resize(frame, (new_w, new_h), dst=buffer, interpolation=cv2.INTER_LINEAR)
+            np.multiply(frame[:, :, ::-1].transpose(2, 0, 1), self.scale,
+                        out=slot[:, pad_y:pad_y + new_h, pad_x:pad_x + new_w], casting='unsafe')
+            letterboxes.append((ratio, pad_x, pad_y, width, height))
+        return letterboxes
+
+    def __call__(self, frames, conf=CONF_THRESHOLD, **kwargs):
+        # imgsz/verbose được bỏ qua: kích thước đầu vào cố định theo bộ đệm
+        torch = self.torch
+        letterboxes = self.prepare(frames)
+        blob = self.blob[:len(frames)]
+        with torch.inference_mode():
+            if self.session is not None:
+                preds = torch.from_numpy(self.session.run(None, {self.input_name: blob})[0])
+            else:
+                preds = self.net(torch.from_numpy(blob))
+            outputs = self.nms(preds, conf, self.iou, max_det=self.max_det)
+        
+        results = []
+        for detections, (ratio, pad_x, pad_y, width, height) in zip(outputs, letterboxes):
+            boxes = detections[:, :4]
+            boxes[:, 0::2] -= pad_x
+            boxes[:, 1::2] -= pad_y
+            boxes /= ratio
+            boxes[:, 0::2].clamp_(0, width)
+            boxes[:, 1::2].clamp_(0, height)
+            results.append(EngineResult(detections))
+        return results
+
+def load_inference_model(model_path=MODEL_PATH, backend='torch', calibration_zip=DEFAULT_CALIBRATION_ZIP,
+                         preprocess='ultralytics'):
+    """Tải mô hình theo backend: torch (mặc định), onnx, onnx-int8 hoặc openvino
+    
+    Các backend khác torch được export tự động từ trọng số .pt ở lần chạy đầu. Với
+    preprocess='buffers', mô hình torch/ONNX được bọc trong PreprocessEngine.
+    """
+    YOLO = import_yolo()
+    onnx_path = None
+    if backend == 'torch':
+        model = YOLO(model_path)
+    elif backend in ('onnx', 'onnx-int8'):
+        onnx_path = export_onnx(model_path)
+        if backend == 'onnx-int8':
+            onnx_path = quantize_onnx_int8(onnx_path, calibration_zip)
+        model = ExportedModel(YOLO(onnx_path, task='detect'), backend)
+    elif backend == 'openvino':
+        model = ExportedModel(YOLO(export_openvino(model_path), task='detect'), backend)
+    else:
+        raise ValueError(f"Backend không hỗ trợ: {backend}")
+    
+    if preprocess == 'buffers':
+        if backend == 'openvino':
+            print("Tiền xử lý bộ đệm chưa hỗ trợ OpenVINO, dùng tiền xử lý của ultralytics")
+        else:
+            return PreprocessEngine(model, backend, onnx_path)
+    return model
+
+def detection_agreement(reference, detections, iou_threshold=0.5):
+    """Độ trùng khớp (F1) giữa 2 tập detection: cùng lớp và IoU >= iou_threshold"""
+    if not reference and not detections:
+        return 1.0
+    matched = 0
+    used = set()
+    for ref in reference:
+        for i, det in enumerate(detections):
+            if i in used or det['cls_id'] != ref['cls_id']:
+                continue
+            if box_iou([ref['box']], [det['box']])[0, 0] >= iou_threshold:
+                used.add(i)
+                matched += 1
+                break
+    return 2 * matched / (len(reference) + len(detections))
+
+def compare_backends(model_path=MODEL_PATH, zip_path=DEFAULT_CALIBRATION_ZIP, backends=BACKENDS,
+                     preprocess='ultralytics'):
+    """So sánh độ trễ và độ trùng khớp kết quả của các backend so với PyTorch"""
+    images = [image for image, _ in iter_labeled_images(zip_path)]
+    if not images:
+        print(f"Không có ảnh nào trong {zip_path}", file=sys.stderr)
+        return 1
+    
+    reference = None
+    print(f"{'Backend':<12}{'TB (ms)':>10}{'p50 (ms)':>10}{'p95 (ms)':>10}{'Trùng khớp':>12}",
+          file=sys.stderr)
+    for backend in backends:
+        try:
+            model = load_inference_model(model_path, backend, zip_path, preprocess)
+        except Exception as e:
+            print(f"{backend:<12} bỏ qua: {e}", file=sys.stderr)
+            continue
+        
+        predict_detections(model, images[:1], imgsz=TRAIN_IMGSZ)  # Chạy thử
+        latencies = []
+        outputs = []
+        for image in images:
+            start = time.perf_counter()
+            outputs.append(predict_detections(model, [image], imgsz=TRAIN_IMGSZ)[0])
+            latencies.append((time.perf_counter() - start) * 1000)
+        if reference is None:
+            reference = outputs
+        
+        agreement = np.mean([detection_agreement(ref, out) for ref, out in zip(reference, outputs)])
+        print(f"{backend:<12}{np.mean(latencies):>10.1f}{np.percentile(latencies, 50):>10.1f}"
+              f"{np.percentile(latencies, 95):>10.1f}{agreement:>12.3f}", file=sys.stderr)
+    return 0
+
+class SignTracker:
+    """Tracker nhẹ kiểu SORT: ghép box giữa các frame theo IoU và mô hình chuyển động
+    
+    Mỗi track giữ box, vận tốc (pixel/giây) và lớp. Box của track được dự đoán tới thời
+    điểm hiện tại rồi ghép tham lam với detection cùng lớp có IoU cao nhất.
+    """
+
+    def __init__(self, iou_threshold=0.3, max_age=5.0, max_predict=0.5, velocity_smoothing=0.5):
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age            # Giây không được ghép trước khi xóa track
+        self.max_predict = max_predict    # Chỉ ngoại suy chuyển động tối đa bấy nhiêu giây
+        self.velocity_smoothing = velocity_smoothing
+        self.tracks = {}  # track id -> trạng thái
+        self.next_id = 1
+
+    def clear(self):
+        self.tracks.clear()
+
+    def predict(self, current_time, track_ids=None):
+        """Dự đoán box của các track tại current_time, trả về (danh sách id, mảng box)"""
+        track_ids = list(self.tracks) if track_ids is None else track_ids
+        if not track_ids:
+            return track_ids, np.zeros((0, 4), dtype=np.float32)
+        boxes = np.array([self.tracks[tid]['box'] for tid in track_ids], dtype=np.float32)
+        velocity = np.array([self.tracks[tid]['velocity'] for tid in track_ids], dtype=np.float32)
+        # Thời điểm giữ ở float64: time.time() (~1.8e9) ở float32 chỉ phân giải được ~128 giây
+        last_seen = np.array([self.tracks[tid]['last_seen'] for tid in track_ids], dtype=np.float64)
+        dt = np.clip(current_time - last_seen, 0, self.max_predict)[:, None]
+        return track_ids, (boxes + velocity * dt).astype(np.float32)
+
+    def update(self, detections, current_time):
+        """Ghép detection với track, gán detection['track_id']
+        
+        Trả về danh sách id các track bị xóa vì quá max_age giây không xuất hiện.
+        """
+        track_ids, predicted = self.predict(current_time)
+        matched_tracks = set()
+        matched_dets = set()
+        
+        if track_ids and detections:
+            det_boxes = np.array([det['box'] for det in detections], dtype=np.float32)
+            iou = box_iou(predicted, det_boxes)
+            # Chỉ ghép cùng lớp
+            track_cls = np.array([self.tracks[tid]['cls_id'] for tid in track_ids])
+            det_cls = np.array([det['cls_id'] for det in detections])
+            iou[track_cls[:, None] != det_cls[None, :]] = 0.0
+            
+            rows, cols = np.nonzero(iou >= self.iou_threshold)
+            order = np.argsort(-iou[rows, cols])
+            for r, c in zip(rows[order], cols[order]):
+                if r in matched_tracks or c in matched_dets:
+                    continue
+                matched_tracks.add(r)
+                matched_dets.add(c)
+                self._update_track(track_ids[r], detections[c], current_time)
+        
+        for i, det in enumerate(detections):
+            if i not in matched_dets:
+                self._create_track(det, current_time)
+        
+        removed = [tid for tid, track in self.tracks.items()
+                   if current_time - track['last_seen'] > self.max_age]
+        for tid in removed:
+            del self.tracks[tid]
+        return removed
+
+    def _create_track(self, det, current_time):
+        track_id = self.next_id
+        self.next_id += 1
+        self.tracks[track_id] = {
+            'box': np.array(det['box'], dtype=np.float32),
+            'velocity': np.zeros(4, dtype=np.float32),
+            'cls_id': det['cls_id'],
+            'label': det['label'],
+            'conf': det['conf'],
+            'first_seen': current_time,
+            'last_seen': current_time,
+        }
+        det['track_id'] = track_id
+
+    def _update_track(self, track_id, det, current_time):
+        track = self.tracks[track_id]
+        box = np.array(det['box'], dtype=np.float32)
+        dt = current_time - track['last_seen']
+        if dt > 0:
+            a = self.velocity_smoothing
+            track['velocity'] = a * (box - track['box']) / dt + (1 - a) * track['velocity']
+        track['box'] = box
+        track['conf'] = det['conf']
+        track['last_seen'] = current_time
+        det['track_id'] = track_id
+
+class SignStabilizer:
+    """Cơ chế ổn định kết quả theo từng track
+    
+    Một track phải được phát hiện ít nhất min_detections lần, kéo dài ít nhất
+    stable_duration giây (chỉ tính các lần trong buffer_timeout giây gần nhất)
+    mới được xác nhận.
+    """
+
+    def __init__(self, stable_duration=0.7, buffer_timeout=5.0, min_detections=2):
+        self.stable_duration = stable_duration
+        self.buffer_timeout = buffer_timeout  # Giữ lịch sử lâu hơn
+        self.min_detections = min_detections  # Cần ít nhất 2 lần phát hiện để xác nhận
+        self.tracker = SignTracker(max_age=buffer_timeout)
+        self.detection_buffer = defaultdict(list)  # track id -> các thời điểm phát hiện
+        self.stable_tracks = set()  # Track đã được xác nhận
+        self.visible_tracks = []    # Track được ghép ở lần nhận diện gần nhất
+
+    def clear(self):
+        self.tracker.clear()
+        self.detection_buffer.clear()
+        self.stable_tracks.clear()
+        self.visible_tracks = []
+
+    def propagate(self, current_time):
+        """Dự đoán box tại current_time cho các track đang thấy, dùng cho frame không chạy mô hình"""
+        track_ids = [tid for tid in self.visible_tracks if tid in self.tracker.tracks]
+        track_ids, boxes = self.tracker.predict(current_time, track_ids)
+        detections = []
+        for track_id, box in zip(track_ids, boxes.tolist()):
+            track = self.tracker.tracks[track_id]
+            detections.append({
+                'box': tuple(box),
+                'cls_id': track['cls_id'],
+                'label': track['label'],
+                'conf': track['conf'],
+                'track_id': track_id,
+                'propagated': True,
+            })
+        return detections
+
+    def is_stable(self, track_id, current_time):
+        """Kiểm tra xem track có ổn định hay không"""
+        # Lọc bỏ timestamp quá cũ
+        timestamps = [t for t in self.detection_buffer[track_id]
+                      if current_time - t < self.buffer_timeout]
+        self.detection_buffer[track_id] = timestamps
+        
+        # Kiểm tra có đủ số lần phát hiện tối thiểu không
+        if len(timestamps) < self.min_detections:
+            return False
+        
+        # Kiểm tra khoảng thời gian từ lần phát hiện đầu tiên
+        time_span = current_time - timestamps[0]
+        return time_span >= self.stable_duration
+
+    def update(self, detections, current_time, propagated=False):
+        """Cập nhật tracker và buffer với các detection của một frame
+        
+        Gán detection['track_id'], trả về (cờ ổn định cho từng detection,
+        danh sách detection có track vừa trở nên ổn định). Với box nội suy hoặc dùng
+        lại khi cảnh tĩnh (propagated=True) chỉ đánh giá lại độ ổn định, không tính là
+        lần phát hiện mới.
+        """
+        if not propagated:
+            removed = self.tracker.update(detections, current_time)
+            for track_id in removed:
+                self.detection_buffer.pop(track_id, None)
+                self.stable_tracks.discard(track_id)
+            self.visible_tracks = [det['track_id'] for det in detections]
+        
+        stable_flags = []
+        new_stable = []
+        for det in detections:
+            track_id = det['track_id']
+            if not propagated:
+                self.detection_buffer[track_id].append(current_time)
+            is_stable = self.is_stable(track_id, current_time)
+            stable_flags.append(is_stable)
+            if is_stable and track_id not in self.stable_tracks:
+                self.stable_tracks.add(track_id)
+                new_stable.append(det)
+        return stable_flags, new_stable
+
+class InferenceScheduler:
+    """Chỉ chạy mô hình mỗi k frame, k tự điều chỉnh theo độ trễ nhận diện
+    
+    k được chọn sao cho thời gian nhận diện chia đều cho k frame nằm trong
+    budget_share phần ngân sách thời gian của một frame (1 / target_fps).
+    """
+
+    def __init__(self, target_fps=30.0, max_interval=5, budget_share=0.8, smoothing=0.2):
+        self.target_fps = target_fps
+        self.max_interval = max_interval
+        self.budget_share = budget_share
+        self.smoothing = smoothing
+        self.reset()
+
+    def reset(self, target_fps=None):
+        if target_fps:
+            self.target_fps = target_fps
+        self.interval = 1
+        self.latency = None      # Độ trễ nhận diện trung bình (EMA), giây
+        self.frames_since = None  # Số frame từ lần nhận diện gần nhất
+        self.inferences = 0
+        self.propagated = 0
+
+    def should_infer(self):
+        """Gọi mỗi frame, trả về True nếu frame này cần chạy mô hình"""
+        if self.frames_since is None or self.frames_since + 1 >= self.interval:
+            self.frames_since = 0
+            self.inferences += 1
+            return True
+        self.frames_since += 1
+        self.propagated += 1
+        return False
+
+    def record_latency(self, seconds):
+        """Cập nhật độ trễ đo được và tính lại k"""
+        if self.latency is None:
+            self.latency = seconds
+        else:
+            self.latency += self.smoothing * (seconds - self.latency)
+        budget = self.budget_share / self.target_fps
+        self.interval = int(min(self.max_interval, max(1, np.ceil(self.latency / budget))))
+
+class ChangeDetector:
+    """Phát hiện thay đổi cảnh bằng hiệu ảnh xám thu nhỏ để bỏ qua nhận diện thừa
+    
+    So sánh frame hiện tại với frame ở lần nhận diện gần nhất (thu nhỏ còn
+    size pixel). Nếu sai khác trung bình dưới threshold (thang 0-255) thì coi như
+    cảnh không đổi; dù vậy vẫn nhận diện lại sau tối đa refresh_interval giây.
+    """
+
+    def __init__(self, threshold=3.0, refresh_interval=2.0, size=(64, 36)):
+        self.threshold = threshold
+        self.refresh_interval = refresh_interval
+        self.size = size
+        self.reset()
+
+    def reset(self):
+        self.reference = None
+        self.reference_time = 0.0
+        self.skipped = 0
+        self.checked = 0
+
+    def has_changed(self, frame, current_time):
+        """Trả về True nếu cần chạy mô hình cho frame này"""
+        if self.threshold <= 0:
+            return True
+        self.checked += 1
+        small = cv2.cvtColor(cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA),
+                             cv2.COLOR_BGR2GRAY)
+        if (self.reference is None
+                or current_time - self.reference_time >= self.refresh_interval
+                or cv2.absdiff(small, self.reference).mean() >= self.threshold):
+            self.reference = small
+            self.reference_time = current_time
+            return True
+        self.skipped += 1
+        return False
+
+ANNOUNCE_PREFIX = "Phát hiện "
+CLASSES_VIE_FILE = 'classes_vie.txt'
+LABEL_FILE = 'label.txt'
+
+# Màu popup (RGB) theo loại biển báo - ký tự đầu của mã trong label.txt
+SIGN_CATEGORY_COLORS = {
+    'P': (220, 20, 60),    # Biển cấm
+    'W': (255, 140, 0),    # Biển báo nguy hiểm
+    'R': (135, 206, 250),  # Biển hiệu lệnh
+    'I': (30, 144, 255),   # Biển chỉ dẫn
+}
+DEFAULT_SIGN_COLOR = (0, 200, 0)
+
+class SignCatalog:
+    """Danh mục biển báo dựng sẵn một lần từ classes_vie.txt và label.txt
+    
+    Mỗi lớp của mô hình (model.names) có một mục gồm tên tiếng Việt, mã đầy đủ,
+    mã rút gọn (R415_xxx -> R415), loại biển, màu hiển thị và câu thông báo.
+    Tra cứu trực tiếp theo class id hoặc theo nhãn, không đọc file trong vòng lặp.
+    """
+
+    def __init__(self, model_names=None, names_file=CLASSES_VIE_FILE, labels_file=LABEL_FILE,
+                 auto_reload=False, check_interval=1.0):
+        self.model_names = dict(model_names) if model_names else None
+        self.names_file = names_file
+        self.labels_file = labels_file
+        self.auto_reload = auto_reload
+        self.check_interval = check_interval
+        self.last_check = 0.0
+        self.mtimes = None
+        self.entries = {}   # class id -> mục
+        self.by_label = {}  # nhãn của mô hình -> mục
+        self.load()
+
+    def _file_mtimes(self):
+        mtimes = []
+        for path in (self.names_file, self.labels_file):
+            try:
+                mtimes.append(os.path.getmtime(path))
+            except OSError:
+                mtimes.append(None)
+        return tuple(mtimes)
+
+    @staticmethod
+    def make_entry(label, name, code):
+        prefix = code.split('_')[0] if code else label
+        category = code[0].upper() if code else ''
+        return {
+            'label': label,
+            'name': name,
+            'code': code,
+            'prefix': prefix,
+            'category': category,
+            'color': SIGN_CATEGORY_COLORS.get(category, DEFAULT_SIGN_COLOR),
+            'announcement': f"{ANNOUNCE_PREFIX}{name}",
+        }
+
+    def load(self):
+        """Đọc lại 2 file danh mục và dựng bảng tra cứu"""
+        self.mtimes = self._file_mtimes()
+        names_vie = read_classes_file(self.names_file)
+        codes = read_classes_file(self.labels_file)
+        if len(names_vie) != len(codes):
+            print(f"Cảnh báo: {self.names_file} có {len(names_vie)} dòng nhưng "
+                  f"{self.labels_file} có {len(codes)} dòng")
+        
+        model_names = self.model_names or {i: str(i) for i in range(len(names_vie))}
+        if len(model_names) != len(names_vie):
+            print(f"Cảnh báo: mô hình có {len(model_names)} lớp nhưng "
+                  f"{self.names_file} có {len(names_vie)} dòng")
+        
+        entries = {}
+        for cls_id, label in model_names.items():
+            # Nhãn của mô hình là chỉ số dòng trong 2 file danh mục
+            idx = int(label) if str(label).isdigit() else -1
+            name = names_vie[idx] if 0 <= idx < len(names_vie) else label
+            code = codes[idx] if 0 <= idx < len(codes) else ''
+            entries[cls_id] = self.make_entry(label, name, code)
+        
+        self.entries = entries
+        self.by_label = {entry['label']: entry for entry in entries.values()}
+
+    def reload_if_changed(self):
+        """Đọc lại danh mục nếu file đã thay đổi (chỉ khi bật auto_reload)
+        
+        Trả về True nếu danh mục vừa được đọc lại.
+        """
+        if not self.auto_reload:
+            return False
+        now = time.monotonic()
+        if now - self.last_check < self.check_interval:
+            return False
+        self.last_check = now
+        if self._file_mtimes() == self.mtimes:
+            return False
+        self.load()
+        print("Đã cập nhật danh mục biển báo")
+        return True
+
+    def get(self, cls_id):
+        return self.entries.get(cls_id) or self.make_entry(f"cls_{cls_id}", f"cls_{cls_id}", '')
+
+    def get_by_label(self, label):
+        return self.by_label.get(label) or self.make_entry(label, label, '')
+
+    def announcements(self):
+        return [entry['announcement'] for entry in self.entries.values()]
+
+DISPLAY_MAX_WIDTH = 1200
+DISPLAY_MAX_HEIGHT = 600
+FONT_CANDIDATES = [
+    "arial.ttf",
+    "C:\\Windows\\Fonts\\arial.ttf",
+    "C:\\Windows\\Fonts\\arialbd.ttf",
+    "DejaVuSans.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+]
+
+class OverlayRenderer:
+    """Vẽ khung, nhãn và popup ở độ phân giải hiển thị
+    
+    Frame được thu nhỏ trước rồi mới vẽ. Font và ảnh popup (sprite) tiếng Việt được
+    dựng một lần cho mỗi (nội dung, màu, cỡ chữ) rồi trộn alpha bằng NumPy, không
+    phải chuyển cả frame sang PIL.
+    """
+
+    def __init__(self, max_width=DISPLAY_MAX_WIDTH, max_height=DISPLAY_MAX_HEIGHT):
+        self.max_width = max_width
+        self.max_height = max_height
+        self.fonts = {}    # cỡ chữ -> font
+        self.sprites = {}  # (nội dung, màu, cỡ chữ) -> (bgr nhân sẵn alpha, 255 - alpha)
+
+    def get_scale(self, width, height):
+        if width > self.max_width or height > self.max_height:
+            return min(self.max_width / width, self.max_height / height)
+        return 1.0
+
+    def fit(self, frame, writable=True):
+        """Thu nhỏ frame về kích thước hiển thị, trả về (ảnh, tỉ lệ)
+        
+        Nếu không cần thu nhỏ và không cần vẽ thì trả về chính frame, không sao chép.
+        """
+        height, width = frame.shape[:2]
+        scale = self.get_scale(width, height)
+        if scale < 1.0:
+            size = (int(width * scale), int(height * scale))
+            return cv2.resize(frame, size, interpolation=cv2.INTER_AREA), scale
+        return (frame.copy() if writable else frame), scale
+
+    def draw_box(self, img, box, scale, color, text):
+        x1, y1, x2, y2 = [int(v * scale) for v in box]
+        cv2.rectangle(img, (x1, y1), (x2, y2), color, 2)
+        (tw, th), _ = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)
+        cv2.rectangle(img, (x1, y1-th-8), (x1+tw+4, y1), color, -1)
+        cv2.putText(img, text, (x1+2, y1-6),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 0), 2, cv2.LINE_AA)
+
+    def get_font(self, size):
+        font = self.fonts.get(size)
+        if font is None:
+            for path in FONT_CANDIDATES:
+                try:
+                    font = ImageFont.truetype(path, size)
+                    break
+                except OSError:
+                    continue
+            else:
+                font = ImageFont.load_default()
+            self.fonts[size] = font
+        return font
+
+    def get_banner(self, text, color, font_size, padding, border):
+        """Lấy sprite popup đã dựng sẵn (màu nền theo RGB)"""
+        key = (text, color, font_size)
+        sprite = self.sprites.get(key)
+        if sprite is not None:
+            return sprite
+        
+        font = self.get_font(font_size)
+        left, top, right, bottom = font.getbbox(text)
+        text_width, text_height = right - left, bottom - top
+        width = text_width + 2 * padding
+        height = text_height + 2 * padding
+        
+        banner = Image.new('RGBA', (width + 1, height + 1), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(banner)
+        draw.rectangle([(0, 0), (width, height)],
+                       fill=color, outline=(255, 255, 255), width=border)
+        draw.text((padding, padding), text, font=font, fill=(255, 255, 255))
+        
+        rgba = np.asarray(banner)
+        alpha = rgba[:, :, 3:4].astype(np.uint16)
+        bgr = rgba[:, :, 2::-1].astype(np.uint16)
+        sprite = (bgr * alpha, 255 - alpha, text_height)
+        self.sprites[key] = sprite
+        return sprite
+
+    def blend(self, img, sprite, x, y):
+        """Trộn alpha sprite vào img tại (x, y), cắt phần nằm ngoài ảnh"""
+        premultiplied, inv_alpha = sprite[0], sprite[1]
+        h, w = inv_alpha.shape[:2]
+        img_h, img_w = img.shape[:2]
+        x0, y0 = max(0, x), max(0, y)
+        x1, y1 = min(img_w, x + w), min(img_h, y + h)
+        if x0 >= x1 or y0 >= y1:
+            return
+        sx, sy = x0 - x, y0 - y
+        roi = img[y0:y1, x0:x1]
+        src = premultiplied[sy:sy + (y1 - y0), sx:sx + (x1 - x0)]
+        inv = inv_alpha[sy:sy + (y1 - y0), sx:sx + (x1 - x0)]
+        roi[:] = (src + roi * inv) // 255
+
+    def draw_banners(self, img, banners, scale, source_width):
+        """Vẽ các popup xếp dọc ở giữa phía trên
+        
+        Kích thước được tính theo frame gốc rồi nhân tỉ lệ để giống khi vẽ ở độ phân giải đầy đủ.
+        """
+        font_size = max(1, int(max(40, min(100, int(source_width * 0.06))) * scale))
+        padding = max(2, int(25 * scale))
+        border = max(1, int(6 * scale))
+        y_offset = int(130 * scale)
+        img_w = img.shape[1]
+        for text, color in banners:
+            premultiplied, inv_alpha, text_height = sprite = self.get_banner(
+                text, color, font_size, padding, border)
+            x = (img_w - inv_alpha.shape[1]) // 2
+            self.blend(img, sprite, x, y_offset - padding)
+            y_offset += text_height + 2 * padding + int(20 * scale)
+
+    def draw_hud(self, img, text):
+        """Vẽ dòng FPS/độ trễ ở góc trên bên trái (chỉ chữ ASCII nên dùng cv2.putText)"""
+        (text_w, text_h), baseline = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 1)
+        cv2.rectangle(img, (0, 0), (text_w + 10, text_h + baseline + 10), (0, 0, 0), -1)
+        cv2.putText(img, text, (5, text_h + 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 1,
+                    cv2.LINE_AA)
+
+def crop_thumbnail(frame, box, max_size=None):
+    """Cắt vùng box (cắt theo biên frame), thu nhỏ cạnh lớn nhất về max_size
+    
+    Thu nhỏ thẳng từ view của frame nên không sao chép vùng cắt ở độ phân giải gốc.
+    Trả về None nếu vùng cắt rỗng.
+    """
+    height, width = frame.shape[:2]
+    x1, y1, x2, y2 = box
+    x1, y1 = max(0, int(x1)), max(0, int(y1))
+    x2, y2 = min(width, int(x2)), min(height, int(y2))
+    if x2 <= x1 or y2 <= y1:
+        return None
+    crop = frame[y1:y2, x1:x2]
+    scale = 1.0 if max_size is None else max_size / max(x2 - x1, y2 - y1)
+    if scale >= 1.0:
+        return crop.copy()
+    size = (max(1, int((x2 - x1) * scale)), max(1, int((y2 - y1) * scale)))
+    return cv2.resize(crop, size, interpolation=cv2.INTER_AREA)
+
+SHARPNESS_SCALE = 100.0  # Phương sai Laplacian ứng với độ nét 0.5
+
+def crop_quality(thumbnail, conf, source_side, thumbnail_size):
+    """Điểm chất lượng ảnh cắt trong [0, 1]: kích thước x độ nét x độ tin cậy
+    
+    Độ nét là phương sai Laplacian trên ảnh đã thu nhỏ; kích thước tính theo cạnh
+    nhỏ của box gốc so với kích thước thumbnail (box đủ lớn thì không cộng thêm).
+    """
+    gray = cv2.cvtColor(thumbnail, cv2.COLOR_BGR2GRAY)
+    sharpness = float(cv2.Laplacian(gray, cv2.CV_32F).var())
+    size = min(1.0, source_side / thumbnail_size)
+    return conf * size * sharpness / (sharpness + SHARPNESS_SCALE)
+
+class SignCropStore:
+    """Ảnh cắt đẹp nhất của từng track, đã thu nhỏ, tổng bộ nhớ có giới hạn
+    
+    Mỗi lần thấy track (tối đa một lần mỗi score_interval giây) ảnh cắt được thu nhỏ
+    và chấm điểm; chỉ thay ảnh đang giữ khi điểm cao hơn. Vượt max_bytes thì bỏ các
+    track lâu không thấy nhất. Mỗi lần thay ảnh tăng 'version' để giao diện vẽ lại;
+    track bị bỏ vì giới hạn bộ nhớ nằm trong 'evicted' chờ giao diện hủy widget.
+    """
+
+    def __init__(self, thumbnail_size=80, max_bytes=2 * 1024 * 1024, score_interval=0.2):
+        self.thumbnail_size = thumbnail_size
+        self.max_bytes = max_bytes
+        self.score_interval = score_interval
+        self.entries = {}  # track_id -> dict ảnh, nhãn, điểm, thời gian
+        self.evicted = []
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+    def update(self, track_id, label, frame, box, conf, now):
+        """Ghi nhận track được thấy; trả về True nếu ảnh của track được thay"""
+        entry = self.entries.get(track_id)
+        if entry is not None:
+            entry['last_seen'] = now
+            if now - entry['last_scored'] < self.score_interval:
+                return False
+            entry['last_scored'] = now
+        thumbnail = crop_thumbnail(frame, box, self.thumbnail_size)
+        if thumbnail is None:
+            return False
+        x1, y1, x2, y2 = box
+        score = crop_quality(thumbnail, conf, min(x2 - x1, y2 - y1), self.thumbnail_size)
+        with self.lock:
+            if entry is None:
+                entry = {'label': label, 'first_stable': now, 'last_seen': now, 'last_scored': now,
+                         'image': None, 'score': -1.0, 'version': 0, 'widget': None,
+                         'widget_version': None}
+                self.entries[track_id] = entry
+            elif score <= entry['score']:
+                return False
+            if entry['image'] is not None:
+                self.total_bytes -= entry['image'].nbytes
+            entry['image'] = thumbnail
+            entry['score'] = score
+            entry['version'] += 1
+            self.total_bytes += thumbnail.nbytes
+            self._enforce_limit(track_id)
+        return True
+
+    def _enforce_limit(self, keep_id):
+        if self.total_bytes <= self.max_bytes:
+            return
+        for track_id, entry in sorted(self.entries.items(), key=lambda item: item[1]['last_seen']):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if track_id != keep_id:
+                self.evicted.append(self._pop(track_id))
+
+    def _pop(self, track_id):
+        entry = self.entries.pop(track_id)
+        if entry['image'] is not None:
+            self.total_bytes -= entry['image'].nbytes
+        return entry
+
+    def remove(self, track_id):
+        """Bỏ một track, trả về dữ liệu của nó (None nếu không có)"""
+        with self.lock:
+            return self._pop(track_id) if track_id in self.entries else None
+
+    def take_evicted(self):
+        """Lấy các track đã bị bỏ vì giới hạn bộ nhớ (để hủy widget)"""
+        with self.lock:
+            evicted, self.evicted = self.evicted, []
+        return evicted
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.evicted = []
+            self.total_bytes = 0
+
+AUDIO_CACHE_DIR = 'audio_cache'
+
+class AudioCache:
+    """Cache âm thanh thông báo theo (giọng, nội dung)
+    
+    Mỗi câu chỉ gọi gTTS một lần, file mp3 được lưu trong AUDIO_CACHE_DIR để dùng lại
+    giữa các lần chạy, còn khi phát thì dùng pygame.mixer.Sound đã giải mã sẵn trong
+    bộ nhớ nên không phải tạo file tạm.
+    """
+
+    def __init__(self, cache_dir=AUDIO_CACHE_DIR, lang='vi', slow=False):
+        self.cache_dir = cache_dir
+        self.lang = lang
+        self.slow = slow
+        self.lock = threading.Lock()
+        self.mp3_data = {}  # key -> bytes mp3
+        self.sounds = {}    # key -> pygame.mixer.Sound
+
+    def _key(self, text):
+        voice = f"{self.lang}|{'slow' if self.slow else 'normal'}"
+        return hashlib.sha1(f"{voice}|{text}".encode('utf-8')).hexdigest()
+
+    def get_mp3(self, text):
+        """Lấy dữ liệu mp3: bộ nhớ -> đĩa -> gTTS (cần mạng)"""
+        key = self._key(text)
+        data = self.mp3_data.get(key)
+        if data is not None:
+            return data
+        
+        path = os.path.join(self.cache_dir, f"{key}.mp3")
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                data = f.read()
+        else:
+            from gtts import gTTS
+            
+            buffer = io.BytesIO()
+            gTTS(text=text, lang=self.lang, slow=self.slow).write_to_fp(buffer)
+            data = buffer.getvalue()
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Ghi ra file tạm rồi đổi tên để không để lại file hỏng khi bị ngắt giữa chừng
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        
+        with self.lock:
+            self.mp3_data[key] = data
+        return data
+
+    def get_sound(self, text):
+        """Lấy pygame.mixer.Sound đã giải mã, trả về None nếu mixer không đọc được mp3"""
+        key = self._key(text)
+        sound = self.sounds.get(key)
+        if sound is not None:
+            return sound
+        data = self.get_mp3(text)
+        try:
+            import pygame
+            sound = pygame.mixer.Sound(file=io.BytesIO(data))
+        except Exception:
+            return None
+        with self.lock:
+            self.sounds[key] = sound
+        return sound
+
+    def prewarm(self, texts):
+        """Tạo sẵn âm thanh cho danh sách câu ở luồng nền"""
+        def worker():
+            start = time.perf_counter()
+            ready = 0
+            for text in texts:
+                try:
+                    self.get_sound(text)
+                    ready += 1
+                except Exception as e:
+                    print(f"Không thể tạo âm thanh cho '{text}': {e}")
+            print(f"Đã chuẩn bị {ready}/{len(texts)} âm thanh thông báo "
+                  f"trong {time.perf_counter() - start:.1f}s")
+        
+        thread = threading.Thread(target=worker, name="audio-prewarm", daemon=True)
+        thread.start()
+        return thread
+
+# Mức ưu tiên phát âm theo nhóm biển báo (nhỏ hơn = phát trước)
+SPEECH_PRIORITIES = {'P': 0, 'W': 0, 'R': 1, 'I': 2}
+DEFAULT_SPEECH_PRIORITY = 1
+SPEECH_DEADLINE = 4.0  # Quá bấy nhiêu giây chưa phát thì bỏ (biển báo đã đi qua)
+
+class SpeechScheduler:
+    """Hàng đợi phát âm theo mức ưu tiên, gộp câu trùng và bỏ câu quá hạn
+    
+    Biển cấm (P) và cảnh báo (W) được phát trước biển hiệu lệnh (R) và chỉ dẫn (I).
+    Câu đang chờ mà được gửi lại thì gộp làm một (gia hạn, giữ mức ưu tiên cao nhất);
+    câu chờ quá deadline thì bỏ. Khi có câu ưu tiên cao hơn câu đang phát, luồng phát
+    được báo dừng (should_stop) và câu bị ngắt không phát lại.
+    """
+
+    def __init__(self, deadline=SPEECH_DEADLINE, metrics=None):
+        self.deadline = deadline
+        self.metrics = metrics or MetricsRegistry()
+        self.condition = threading.Condition()
+        self.pending = {}  # câu -> mục chờ phát
+        self.current = None
+        self.preempt = False
+        self.sequence = 0
+
+    @staticmethod
+    def priority_for(category):
+        return SPEECH_PRIORITIES.get(category, DEFAULT_SPEECH_PRIORITY)
+
+    def submit(self, text, priority=DEFAULT_SPEECH_PRIORITY, now=None):
+        """Thêm câu cần phát (không chặn)"""
+        now = time.monotonic() if now is None else now
+        with self.condition:
+            current = self.current
+            if current is not None and current['text'] == text:
+                self.metrics.inc(METRIC_SPEECH_DROPPED, reason='coalesced')
+                return
+            item = self.pending.get(text)
+            if item is not None:
+                item['priority'] = min(item['priority'], priority)
+                item['deadline'] = now + self.deadline
+                self.metrics.inc(METRIC_SPEECH_DROPPED, reason='coalesced')
+            else:
+                self.sequence += 1
+                self.pending[text] = {'text': text, 'priority': priority, 'posted': now,
+                                      'deadline': now + self.deadline, 'seq': self.sequence}
+            if current is not None and priority < current['priority']:
+                self.preempt = True
+            self.condition.notify()
+
+    def _drop_expired(self, now):
+        expired = [text for text, item in self.pending.items() if item['deadline'] < now]
+        for text in expired:
+            del self.pending[text]
+            self.metrics.inc(METRIC_SPEECH_DROPPED, reason='expired')
+
+    def get(self, timeout=None):
+        """Lấy câu ưu tiên cao nhất còn hạn (chặn), trả về None nếu hết timeout"""
+        end = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                self._drop_expired(now)
+                if self.pending:
+                    break
+                remaining = None if end is None else end - now
+                if remaining is not None and remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+            item = min(self.pending.values(), key=lambda item: (item['priority'], item['seq']))
+            del self.pending[item['text']]
+            self.current = item
+            self.preempt = False
+        self.metrics.observe(METRIC_SPEECH_WAIT, now - item['posted'], priority=str(item['priority']))
+        return item
+
+    def is_expired(self, item):
+        """Câu đã quá hạn (vd: lấy âm thanh từ gTTS quá lâu)"""
+        if time.monotonic() <= item['deadline']:
+            return False
+        self.metrics.inc(METRIC_SPEECH_DROPPED, reason='expired')
+        return True
+
+    def should_stop(self):
+        """Có câu ưu tiên cao hơn câu đang phát"""
+        return self.preempt
+
+    def done(self, preempted=False):
+        if preempted:
+            self.metrics.inc(METRIC_SPEECH_DROPPED, reason='preempted')
+        with self.condition:
+            self.current = None
+            self.preempt = False
+
+    def clear(self):
+        with self.condition:
+            self.pending.clear()
+
+    def qsize(self):
+        return len(self.pending)
+
+# Thời gian chờ mở/đọc luồng mạng trước khi coi là mất kết nối
+STREAM_TIMEOUT_MS = 5000
+
+def is_url(source):
+    return '://' in str(source)
+
+def is_live_source(source):
+    """Camera (chỉ số) hoặc luồng mạng: không giữ nhịp phát, chỉ xử lý frame mới nhất"""
+    return str(source).isdigit() or is_url(source)
+
+class LatestFrameGrabber:
+    """Đọc liên tục luồng mạng (RTSP/HTTP) ở luồng riêng, chỉ giữ frame mới nhất
+    
+    Bộ đệm nội bộ của OpenCV được rút liên tục nên read() luôn trả frame mới nhất
+    thay vì frame cũ nằm chờ khi nhận diện chậm. Mất kết nối thì mở lại với thời gian
+    chờ tăng dần. Có cùng các hàm read/get/set/isOpened/release như cv2.VideoCapture
+    nên dùng thay được ở mọi chỗ đang dùng cap.
+    
+    start() trả về ngay, việc kết nối diễn ra ở luồng đọc; on_status (nếu có) được
+    gọi từ luồng đọc mỗi khi trạng thái đổi: 'connecting', 'connected', 'reconnecting'.
+    """
+
+    def __init__(self, url, reconnect_delay=0.5, max_reconnect_delay=10.0, smoothing=0.1,
+                 on_status=None):
+        self.url = url
+        self.on_status = on_status
+        self.status = None
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.smoothing = smoothing
+        self.condition = threading.Condition()
+        self.cap = None
+        self.frame = None
+        self.frame_time = None   # Thời điểm nhận frame mới nhất (perf_counter)
+        self.frame_id = 0
+        self.read_id = 0         # Id frame mới nhất đã trả cho read()
+        self.running = False
+        self.connected = False
+        self.fps = 0.0
+        self.stats = {'grabbed': 0, 'delivered': 0, 'skipped': 0, 'reconnects': 0,
+                      'latency': 0.0}
+        self.thread = None
+
+    def start(self):
+        """Chạy luồng đọc (không chờ kết nối, không chặn luồng giao diện)"""
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="stream-grabber", daemon=True)
+        self.thread.start()
+        return self
+
+    def _set_status(self, status):
+        if status == self.status:
+            return
+        self.status = status
+        if self.on_status:
+            self.on_status(self, status)
+
+    def _open(self):
+        params = []
+        if hasattr(cv2, 'CAP_PROP_OPEN_TIMEOUT_MSEC'):
+            params = [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, STREAM_TIMEOUT_MS,
+                      cv2.CAP_PROP_READ_TIMEOUT_MSEC, STREAM_TIMEOUT_MS]
+        cap = cv2.VideoCapture(self.url, cv2.CAP_FFMPEG, params)
+        if not cap.isOpened():
+            cap.release()
+            return None
+        return cap
+
+    def _run(self):
+        delay = self.reconnect_delay
+        while self.running:
+            if self.cap is None:
+                self._set_status('reconnecting' if self.stats['reconnects'] else 'connecting')
+                cap = self._open()
+                if cap is None:
+                    print(f"Không kết nối được {self.url}, thử lại sau {delay:.1f}s")
+                    time.sleep(delay)
+                    delay = min(self.max_reconnect_delay, delay * 2)
+                    continue
+                self.cap = cap
+                self.fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+                self.connected = True
+                self._set_status('connected')
+            
+            ret, frame = self.cap.read()
+            if not ret:
+                print(f"Mất kết nối {self.url}, đang kết nối lại...")
+                self.cap.release()
+                self.cap = None
+                self.connected = False
+                with self.condition:
+                    # Bỏ frame chưa đọc từ trước khi mất kết nối, chờ frame mới
+                    self.read_id = self.frame_id
+                    self.stats['reconnects'] += 1
+                continue
+            
+            delay = self.reconnect_delay
+            with self.condition:
+                if self.frame_id > self.read_id:
+                    # Frame trước chưa được đọc đã bị thay bằng frame mới hơn
+                    self.stats['skipped'] += 1
+                self.frame = frame
+                self.frame_time = time.perf_counter()
+                self.frame_id += 1
+                self.stats['grabbed'] += 1
+                self.condition.notify_all()
+        
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+        self.connected = False
+
+    def read(self):
+        """Chờ và trả về frame mới hơn frame đã đọc lần trước, (False, None) khi đã dừng"""
+        with self.condition:
+            while self.running and self.frame_id <= self.read_id:
+                self.condition.wait(0.1)
+            if not self.running:
+                return False, None
+            self.read_id = self.frame_id
+            latency = time.perf_counter() - self.frame_time
+            self.stats['latency'] += self.smoothing * (latency - self.stats['latency'])
+            self.stats['delivered'] += 1
+            return True, self.frame
+
+    def get_stats(self):
+        """Bộ đếm kèm tuổi frame mới nhất (giây kể từ lúc nhận) và độ trễ giao frame (EMA)"""
+        with self.condition:
+            stats = dict(self.stats)
+            stats['age'] = time.perf_counter() - self.frame_time if self.frame_time else None
+        stats['connected'] = self.connected
+        return stats
+
+    def isOpened(self):
+        # Đang chạy là "mở", kể cả khi còn đang kết nối: read() sẽ chờ frame đầu tiên
+        return self.running
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        cap = self.cap
+        return cap.get(prop) if cap is not None else 0.0
+
+    def set(self, prop, value):
+        # Bộ đệm đã được rút liên tục nên không cần chỉnh thuộc tính của capture
+        return False
+
+    def release(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+def serve_mjpeg(video_path, port=8554, host='127.0.0.1', quality=80):
+    """Phát file video thành luồng MJPEG qua HTTP (lặp vô hạn theo fps của file)
+    
+    Dùng thay camera IP thật để thử nguồn URL: http://host:port/stream.mjpg
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    
+    class MjpegHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            cap = cv2.VideoCapture(video_path)
+            if not cap.isOpened():
+                self.send_error(500, f"Không mở được {video_path}")
+                return
+            interval = 1.0 / (cap.get(cv2.CAP_PROP_FPS) or 30.0)
+            self.send_response(200)
+            self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=frame')
+            self.end_headers()
+            next_time = time.perf_counter()
+            try:
+                while True:
+                    ret, frame = cap.read()
+                    if not ret:
+                        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                        continue
+                    data = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+                    self.wfile.write(b"--frame\r\nContent-Type: image/jpeg\r\n"
+                                     + f"Content-Length: {len(data)}\r\n\r\n".encode() + data + b"\r\n")
+                    next_time += interval
+                    time.sleep(max(0.0, next_time - time.perf_counter()))
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            finally:
+                cap.release()
+        
+        def log_message(self, format, *args):
+            pass
+    
+    server = ThreadingHTTPServer((host, port), MjpegHandler)
+    print(f"Đang phát {video_path} tại http://{host}:{port}/stream.mjpg (Ctrl+C để dừng)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+# Số frame video được giải mã trước vào hàng đợi của pipeline
+VIDEO_PREFETCH_FRAMES = 4
+
+class PlaybackClock:
+    """Đồng hồ phát video theo thời điểm của frame trong video và đồng hồ đơn điệu
+    
+    Frame ở thời điểm t (giây, theo CAP_PROP_POS_MSEC) cần lên màn hình lúc
+    anchor_wall + (t - anchor_media) / speed. Đổi tốc độ hoặc tạm dừng thì đặt lại mốc,
+    nên video không trôi dù nhận diện nhanh hay chậm hơn thời gian thực.
+    """
+
+    def __init__(self, speed=1.0, fps=30.0):
+        self.speed = speed
+        self.frame_duration = 1.0 / fps
+        self.lock = threading.Lock()
+        self.anchor = None       # (giờ thực, thời điểm trong video)
+        self.last_shown = None
+        self.window = None       # Mốc đo tốc độ thực tế
+        self.achieved_speed = None
+
+    def _media_now(self, now):
+        wall, media = self.anchor
+        return media + (now - wall) * self.speed
+
+    def set_speed(self, speed):
+        with self.lock:
+            now = time.perf_counter()
+            if self.anchor is not None:
+                self.anchor = (now, self._media_now(now))
+            self.speed = speed
+            self.window = None
+
+    def reset(self):
+        """Bỏ mốc hiện tại (vd: khi tiếp tục sau tạm dừng), frame kế tiếp làm mốc mới"""
+        with self.lock:
+            self.anchor = None
+            self.window = None
+
+    def due_time(self, media_time):
+        """Thời điểm (perf_counter) frame cần được hiển thị"""
+        with self.lock:
+            if self.anchor is None:
+                self.anchor = (time.perf_counter(), media_time)
+            wall, media = self.anchor
+            return wall + (media_time - media) / self.speed
+
+    def is_behind(self, media_time):
+        """Frame đã trễ lịch quá một frame, nên bỏ qua để bắt kịp"""
+        with self.lock:
+            if self.anchor is None:
+                return False
+            return media_time + self.frame_duration < self._media_now(time.perf_counter())
+
+    def on_shown(self, media_time):
+        """Gọi sau khi hiển thị frame, cập nhật tốc độ thực tế mỗi giây"""
+        now = time.perf_counter()
+        with self.lock:
+            self.last_shown = media_time
+            if self.window is None:
+                self.window = (now, media_time)
+            elif now - self.window[0] >= 1.0:
+                self.achieved_speed = (media_time - self.window[1]) / (now - self.window[0])
+                self.window = (now, media_time)
+
+class StridedVideoReader:
+    """Đọc video file với bước nhảy và bỏ qua frame đã trễ lịch phát
+    
+    Chỉ lấy ảnh của 1 trong stride frame (stride theo phần nguyên của tốc độ phát).
+    Khi có clock, các frame mà thời điểm trong video đã bị đồng hồ phát vượt qua cũng
+    bị bỏ. Frame bị bỏ chỉ gọi grab() (không retrieve) nên không tốn chuyển màu, sao
+    chép, nhận diện và vẽ.
+    """
+
+    def __init__(self, cap, stride=1, clock=None):
+        self.cap = cap
+        self.stride = stride
+        self.clock = clock
+        self.frame_duration = clock.frame_duration if clock else 1.0 / (cap.get(cv2.CAP_PROP_FPS) or 30.0)
+        self.position = -self.frame_duration  # Thời điểm (giây) của frame vừa đọc
+        self.skipped = 0
+        self.late_skipped = 0
+        self.decoded = 0
+
+    @staticmethod
+    def stride_for_speed(speed):
+        return max(1, int(speed))
+
+    def _grab(self):
+        if not self.cap.grab():
+            return False
+        self._update_position()
+        return True
+
+    def _update_position(self):
+        position = self.cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+        # Một số backend không trả thời điểm: suy ra từ fps
+        self.position = position if position > self.position else self.position + self.frame_duration
+
+    def read(self):
+        for _ in range(self.stride - 1):
+            if not self._grab():
+                return False, None
+            self.skipped += 1
+        if self.clock is not None:
+            while self.clock.is_behind(self.position + self.frame_duration):
+                if not self._grab():
+                    return False, None
+                self.late_skipped += 1
+        ret, frame = self.cap.read()
+        if ret:
+            self._update_position()
+            self.decoded += 1
+        return ret, frame
+
+EVENTS_DB = 'events.db'
+
+class EventStore:
+    """Lưu sự kiện biển báo ổn định vào SQLite, ghi theo lô ở luồng nền
+    
+    Vòng nhận diện chỉ đưa sự kiện vào hàng đợi có giới hạn (không bao giờ chờ ổ
+    đĩa, hàng đợi đầy thì bỏ sự kiện và đếm lại). Luồng ghi thu nhỏ ảnh cắt thành
+    JPEG rồi ghi mỗi lô trong một transaction. Có chỉ mục theo thời gian và theo
+    mã biển báo + thời gian để truy vấn nhanh.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY,
+            ts REAL NOT NULL,
+            source TEXT,
+            frame_index INTEGER,
+            track_id INTEGER,
+            cls_id INTEGER,
+            label TEXT,
+            code TEXT,
+            name TEXT,
+            x1 REAL, y1 REAL, x2 REAL, y2 REAL,
+            conf REAL,
+            thumbnail BLOB
+        );
+        CREATE INDEX IF NOT EXISTS idx_events_ts ON events(ts);
+        CREATE INDEX IF NOT EXISTS idx_events_code_ts ON events(code, ts);
+    """
+    COLUMNS = ('ts', 'source', 'frame_index', 'track_id', 'cls_id', 'label', 'code', 'name',
+               'x1', 'y1', 'x2', 'y2', 'conf', 'thumbnail')
+    _CLOSE = object()
+
+    def __init__(self, path=EVENTS_DB, batch_size=64, flush_interval=1.0, queue_size=1000,
+                 thumbnail_size=96, jpeg_quality=80):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.thumbnail_size = thumbnail_size
+        self.jpeg_quality = jpeg_quality
+        self.queue = Queue(maxsize=queue_size)
+        self.written = 0
+        self.dropped = 0
+        with sqlite3.connect(path) as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(self.SCHEMA)
+        self.thread = threading.Thread(target=self._run, name="event-writer", daemon=True)
+        self.thread.start()
+
+    def record(self, det, entry, source=None, frame_index=None, crop=None, timestamp=None):
+        """Đưa một sự kiện vào hàng đợi ghi (không chặn), trả về False nếu hàng đợi đầy"""
+        x1, y1, x2, y2 = det['box']
+        event = {
+            'ts': timestamp or time.time(),
+            'source': None if source is None else str(source),
+            'frame_index': frame_index,
+            'track_id': det.get('track_id'),
+            'cls_id': det['cls_id'],
+            'label': det['label'],
+            'code': entry['prefix'],
+            'name': entry['name'],
+            'x1': x1, 'y1': y1, 'x2': x2, 'y2': y2,
+            'conf': det['conf'],
+            'thumbnail': crop,
+        }
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except Full:
+            self.dropped += 1
+            return False
+
+    def _encode_thumbnail(self, crop):
+        if crop is None or crop.size == 0:
+            return None
+        height, width = crop.shape[:2]
+        scale = self.thumbnail_size / max(height, width)
+        if scale < 1.0:
+            crop = cv2.resize(crop, (max(1, int(width * scale)), max(1, int(height * scale))),
+                              interpolation=cv2.INTER_AREA)
+        ok, data = cv2.imencode('.jpg', crop, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+        return sqlite3.Binary(data.tobytes()) if ok else None
+
+    def _run(self):
+        conn = sqlite3.connect(self.path)
+        insert = (f"INSERT INTO events ({', '.join(self.COLUMNS)}) "
+                  f"VALUES ({', '.join('?' * len(self.COLUMNS))})")
+        closing = False
+        try:
+            while not closing:
+                try:
+                    batch = [self.queue.get(timeout=self.flush_interval)]
+                except Empty:
+                    continue
+                while len(batch) < self.batch_size:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except Empty:
+                        break
+                closing = any(event is self._CLOSE for event in batch)
+                events = [event for event in batch if event is not self._CLOSE]
+                if not events:
+                    continue
+                rows = []
+                for event in events:
+                    event['thumbnail'] = self._encode_thumbnail(event['thumbnail'])
+                    rows.append(tuple(event[column] for column in self.COLUMNS))
+                try:
+                    with conn:
+                        conn.executemany(insert, rows)
+                    self.written += len(rows)
+                except sqlite3.Error as e:
+                    print(f"Lỗi khi ghi sự kiện vào {self.path}: {e}")
+        finally:
+            conn.close()
+
+    def close(self, timeout=5.0):
+        """Ghi nốt các sự kiện còn trong hàng đợi rồi dừng luồng ghi"""
+        self.queue.put(self._CLOSE)
+        self.thread.join(timeout)
+
+    def query(self, start=None, end=None, code=None, limit=None, with_thumbnails=False):
+        """Truy vấn sự kiện theo khoảng thời gian (epoch giây) và mã biển báo (vd: R415)"""
+        return self.select(self.path, start, end, code, limit, with_thumbnails)
+
+    @classmethod
+    def select(cls, path, start=None, end=None, code=None, limit=None, with_thumbnails=False):
+        """Như query() nhưng đọc thẳng file, không cần mở luồng ghi"""
+        columns = [column for column in cls.COLUMNS if with_thumbnails or column != 'thumbnail']
+        sql = f"SELECT id, {', '.join(columns)} FROM events"
+        conditions, params = [], []
+        if code:
+            conditions.append("code = ?")
+            params.append(code)
+        if start is not None:
+            conditions.append("ts >= ?")
+            params.append(start)
+        if end is not None:
+            conditions.append("ts < ?")
+            params.append(end)
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY ts"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        with sqlite3.connect(path) as conn:
+            conn.row_factory = sqlite3.Row
+            return [dict(row) for row in conn.execute(sql, params)]
+
+def parse_event_time(value):
+    """Thời điểm dạng epoch giây hoặc ISO (vd: 2024-05-01T08:00) -> epoch giây"""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+def query_events(db_path, code=None, since=None, until=None, limit=None):
+    """In các sự kiện đã lưu dạng JSONL (không kèm ảnh)"""
+    if not os.path.exists(db_path):
+        print(f"Không tìm thấy {db_path}", file=sys.stderr)
+        return 1
+    for event in EventStore.select(db_path, parse_event_time(since), parse_event_time(until),
+                                   code, limit):
+        print(json.dumps(event, ensure_ascii=False))
+    return 0
+
+def open_capture(source, on_status=None):
+    """Mở nguồn video: số là chỉ số camera, URL là luồng mạng, còn lại là đường dẫn file
+    
+    on_status chỉ dùng cho URL, xem LatestFrameGrabber.
+    """
+    if is_url(source):
+        return LatestFrameGrabber(source, on_status=on_status).start()
+    return cv2.VideoCapture(int(source) if str(source).isdigit() else source)
+
+class SharedBatchInference:
+    """Một mô hình dùng chung cho nhiều nguồn, gom frame đang chờ của các nguồn thành một lô
+    
+    Luồng inference của mỗi nguồn gửi frame rồi chờ kết quả, nên mỗi nguồn có tối đa
+    một frame chờ. Luồng suy luận lấy frame theo vòng tròn, bắt đầu từ nguồn ngay sau
+    nguồn được phục vụ cuối cùng của lô trước, tối đa max_batch frame mỗi lần gọi mô
+    hình, nên nguồn có fps cao không chiếm hết lượt của nguồn khác.
+    """
+
+    def __init__(self, model, tiling=None, max_batch=4, gather_timeout=0.005, metrics=None):
+        self.model = model
+        self.tiling = tiling or TiledInference()
+        self.max_batch = max_batch
+        self.gather_timeout = gather_timeout  # Chờ thêm frame của nguồn khác trước khi chạy lô
+        self.metrics = metrics or MetricsRegistry()
+        self.condition = threading.Condition()
+        self.order = []    # Id các nguồn theo thứ tự đăng ký
+        self.pending = {}  # id nguồn -> yêu cầu đang chờ
+        self.next_index = 0
+        self.running = False
+        self.batches = 0
+        self.frames = 0
+
+    def register(self, stream_id):
+        with self.condition:
+            self.order.append(stream_id)
+
+    def unregister(self, stream_id):
+        with self.condition:
+            if stream_id in self.order:
+                self.order.remove(stream_id)
+            request = self.pending.pop(stream_id, None)
+        if request is not None:
+            request['event'].set()
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self._run, name="shared-inference", daemon=True).start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            requests = list(self.pending.values())
+            self.pending.clear()
+            self.condition.notify_all()
+        for request in requests:
+            request['event'].set()
+
+    def infer(self, stream_id, frame):
+        """Gửi frame và chờ detection (gọi từ luồng inference của nguồn), [] nếu đã dừng"""
+        request = {'frame': frame, 'event': threading.Event(), 'detections': []}
+        with self.condition:
+            if not self.running:
+                return []
+            self.pending[stream_id] = request
+            self.condition.notify_all()
+        request['event'].wait()
+        return request['detections']
+
+    def _take_batch(self):
+        """Chọn tối đa max_batch yêu cầu theo vòng tròn (gọi khi đang giữ condition)"""
+        batch = []
+        count = len(self.order)
+        for offset in range(count):
+            index = (self.next_index + offset) % count
+            stream_id = self.order[index]
+            if stream_id in self.pending:
+                batch.append(self.pending.pop(stream_id))
+                self.next_index = (index + 1) % count
+                if len(batch) == self.max_batch:
+                    break
+        return batch
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.pending:
+                    self.condition.wait(0.1)
+                # Đợi thêm một chút để các nguồn khác kịp gửi frame vào cùng lô
+                deadline = time.perf_counter() + self.gather_timeout
+                while (self.running and len(self.pending) < min(self.max_batch, len(self.order))
+                       and time.perf_counter() < deadline):
+                    self.condition.wait(max(0.0, deadline - time.perf_counter()))
+                if not self.running:
+                    break
+                batch = self._take_batch()
+            
+            try:
+                start = time.perf_counter()
+                results = self.tiling.predict(self.model, [request['frame'] for request in batch])
+                self.metrics.observe(METRIC_MODEL_LATENCY, time.perf_counter() - start,
+                                     backend='shared', mode=self.tiling.mode)
+            except Exception as e:
+                print(f"Lỗi khi nhận diện lô nhiều nguồn: {e}")
+                results = [[] for _ in batch]
+            self.batches += 1
+            self.frames += len(batch)
+            for request, detections in zip(batch, results):
+                request['detections'] = detections
+                request['event'].set()
+
+class VideoStream:
+    """Trạng thái riêng của một nguồn ở chế độ nhiều nguồn: capture, ổn định và ảnh hiển thị
+    
+    Mỗi nguồn có pipeline, bộ ổn định, lập lịch nhận diện và phát hiện cảnh tĩnh riêng,
+    còn mô hình được dùng chung qua SharedBatchInference.
+    """
+
+    def __init__(self, stream_id, source, cap, batcher, cell_size, on_stable=None):
+        self.stream_id = stream_id
+        self.source = source
+        self.name = f"#{stream_id + 1} {os.path.basename(str(source)) or source}"
+        # cv2.putText chỉ vẽ được chữ ASCII
+        self.hud_name = unicodedata.normalize('NFKD', self.name).encode('ascii', 'ignore').decode('ascii')
+        self.cap = cap
+        self.batcher = batcher
+        self.on_stable = on_stable  # (nguồn, detection, frame) -> None khi có biển báo ổn định mới
+        self.is_camera = is_live_source(source)
+        self.fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        self.stabilizer = SignStabilizer()
+        self.scheduler = InferenceScheduler(self.fps)
+        self.change_detector = ChangeDetector()
+        self.overlay = OverlayRenderer(*cell_size)
+        self.last_detections = []
+        self.pipeline = None
+        self.reader = None  # StridedVideoReader nếu nguồn là file video
+
+    def process(self, frame):
+        """Nhận diện, ổn định và vẽ box cho một frame, trả về ảnh đã thu nhỏ về ô lưới"""
+        if self.scheduler.should_infer():
+            current_time = time.time()
+            if self.change_detector.has_changed(frame, current_time):
+                infer_start = time.perf_counter()
+                detections = self.batcher.infer(self.stream_id, frame)
+                self.scheduler.record_latency(time.perf_counter() - infer_start)
+                current_time = time.time()
+                self.last_detections = detections
+                reused = False
+            else:
+                detections = [dict(det) for det in self.last_detections]
+                reused = True
+            stable_flags, new_stable = self.stabilizer.update(detections, current_time,
+                                                              propagated=reused)
+        else:
+            current_time = time.time()
+            detections = self.stabilizer.propagate(current_time)
+            stable_flags, new_stable = self.stabilizer.update(detections, current_time, propagated=True)
+        
+        if self.on_stable:
+            for det in new_stable:
+                self.on_stable(self, det, frame)
+        
+        annotated, scale = self.overlay.fit(frame)
+        for det, is_stable in zip(detections, stable_flags):
+            color = (0, 255, 0) if is_stable else (0, 165, 255)
+            status = "✓" if is_stable else "..."
+            self.overlay.draw_box(annotated, det['box'], scale, color,
+                                  f"{status} {det['label']} {det['conf']:.2f}")
+        self.overlay.draw_hud(annotated, self.hud_name)
+        return annotated
 
 class TrafficSignDetectionApp:
-    def __init__(self, root):
+    def __init__(self, root, watch_catalog=False, tiling=None, change_detector=None,
+                 model_path=MODEL_PATH, backend='torch', preprocess='ultralytics', metrics=None,
+                 show_hud=False, streams=None, camera_source='0', event_store=None):
         self.root = root
         self.root.title("🚦 Ứng dụng Nhận diện Biển báo Giao thông")
         self.root.geometry("1400x900")
@@ -37,145 +2381,265 @@ class TrafficSignDetectionApp:
             'border': '#4a4a6a'
         }
         
-        # Khởi tạo pygame mixer cho âm thanh
-        try:
-            pygame.mixer.init()
-        except:
-            print("Không thể khởi tạo pygame mixer")
+        # Cache âm thanh thông báo (tạo sẵn ở luồng nền sau khi đọc danh sách lớp)
+        self.audio_cache = AudioCache()
         
-        # Hàng đợi phát âm để đọc tuần tự
-        self.speech_queue = Queue()
+        # Hàng đợi phát âm theo mức ưu tiên, bỏ câu quá hạn
+        self.speech = SpeechScheduler(metrics=metrics)
         self.is_speaking = False
         self.speech_worker_thread = threading.Thread(target=self.speech_worker, daemon=True)
         self.speech_worker_thread.start()
         
-        # Khởi tạo YOLO model
+        # Mô hình YOLO được tải ở luồng nền sau khi giao diện đã hiện
         self.model = None
-        self.load_model()
+        self.model_path = model_path
+        self.backend = backend
+        self.preprocess = preprocess
+        self.model_loading = False
+        self.model_error = None
+        self.startup_report = None
         
         # Biến điều khiển
         self.is_camera_active = False
         self.is_video_active = False
         self.is_paused = False
         self.cap = None
+        self.camera_source = camera_source  # Chỉ số camera hoặc URL (RTSP/HTTP)
+        self.pipeline = None  # FramePipeline đang chạy
         self.video_path = None
+        self.video_reader = None  # StridedVideoReader của video đang phát
         self.current_frame = None
         self.detected_history = []
         self.current_playing_audio = None  # Lưu trữ luồng âm thanh đang phát
         self.video_speed = 1.0  # Tốc độ video (1.0 = bình thường, 2.0 = x2, 0.5 = x0.5)
         
         # Cơ chế ổn định kết quả (stabilization) - đã tối ưu
-        self.detection_buffer = defaultdict(list)
-        self.stable_duration = 0.7
-        self.buffer_timeout = 5.0  # Tăng lên 3s để giữ lịch sử lâu hơn
-        self.min_detections = 2  # Cần ít nhất 2 lần phát hiện để xác nhận
+        self.stabilizer = SignStabilizer()
+        # Lập lịch nhận diện: chạy mô hình mỗi k frame, các frame giữa nội suy box
+        self.scheduler = InferenceScheduler()
+        self.source_fps = 30.0
+        # Nhận diện toàn khung hình hoặc theo vùng quan tâm / lưới ô
+        self.tiling = tiling or TiledInference()
+        # Bỏ qua nhận diện khi cảnh không thay đổi (xe đỗ, camera cố định)
+        self.change_detector = change_detector or ChangeDetector()
+        self.last_detections = []
         
         # Quản lý hiển thị log và ảnh biển báo
         self.show_log = True
         self.enable_sound = True  # Bật/tắt âm thanh
-        self.sign_images = {}
+        self.crop_store = SignCropStore()
+        self.sign_images = self.crop_store.entries
         self.sign_popup_text = {}
         self.display_duration = 3.0  # Tăng lên 3s để hiển thị lâu hơn
         self.capture_delay = 0.5  # Giảm xuống 0.5s để hiển thị nhanh hơn
-        self.recapture_interval = 5.0  # Chụp lại sau mỗi 5 giây
-        
-        # Tải danh sách các lớp từ file classes_vie.txt
-        self.class_names_vie = self.read_classes_file('classes_vie.txt')
-        self.class_labels = self.read_classes_file('label.txt')
+        self.overlay = OverlayRenderer()
+        
+        # Khung hình chờ hiển thị (worker ghi, luồng chính đọc)
+        self.display_fps = 30
+        self.display_lock = threading.Lock()
+        self.pending_frame = None
+        self.photo = None  # PhotoImage dùng lại giữa các frame
+        self.display_stats = {'posted': 0, 'shown': 0, 'skipped': 0}
+        self.fps_sample = {'time': time.perf_counter(), 'processed': 0, 'shown': 0,
+                           'pipeline': None}
+        
+        # Metric cho Prometheus (tắt mặc định) và dòng FPS/độ trễ vẽ trên video
+        self.metrics = metrics or MetricsRegistry()
+        self.metrics.add_collector(self.collect_metrics)
+        self.show_hud = show_hud
+        self.hud_text = ""
+        
+        # Lưu sự kiện biển báo ổn định xuống SQLite (None = không lưu)
+        self.event_store = event_store
+        
+        # Chế độ nhiều nguồn: mỗi nguồn một pipeline, hiển thị dạng lưới
+        self.stream_sources = list(streams or [])
+        self.streams = []
+        self.batcher = None
+        self.is_multi_active = False
+        self.grid_canvas = None
+        self.grid_dirty = False
+        
+        # Danh mục biển báo (tên tiếng Việt, mã, màu...) - dựng lại theo lớp của mô hình khi tải xong
+        self.watch_catalog = watch_catalog
+        self.catalog = SignCatalog(auto_reload=watch_catalog)
+        
+        # Cập nhật giao diện từ worker được gom lại và vẽ trên luồng chính
+        self.ui = UiDispatcher()
+        self.ui.register('info', self.show_info)
+        self.ui.register('log', self.render_detection_log)
+        self.ui.register('video_finished', self.show_video_finished)
+        self.ui.register('stream_status', self.show_stream_status)
+        self.ui_interval = 0.1  # Nhịp vẽ lại dòng thông báo, log và ảnh biển báo (giây)
+        self.ui_last_flush = 0.0
         
         # Tạo giao diện
         self.create_widgets()
         self.setup_styles()
+        
+        # Hiển thị trên luồng chính với tốc độ giới hạn, độc lập với tốc độ nhận diện
+        self.root.after(0, self.display_tick)
+        
+        # Tải mô hình ở luồng nền để cửa sổ hiện ngay
+        self.load_model()
     
-    def speak_text(self, text):
-        """Thêm text vào hàng đợi để phát âm tuần tự"""
+    def speak_text(self, text, category=None):
+        """Thêm text vào hàng đợi phát âm, ưu tiên theo nhóm biển báo (P, W, R, I)"""
         if self.enable_sound:
-            self.speech_queue.put(text)
+            self.speech.submit(text, SpeechScheduler.priority_for(category))
     
     def speech_worker(self):
         """Worker thread xử lý hàng đợi phát âm - đọc từng cái một"""
+        # Import và khởi tạo pygame mixer ở luồng nền để không làm chậm khởi động
+        import pygame
+        try:
+            pygame.mixer.init()
+        except:
+            print("Không thể khởi tạo pygame mixer")
+        
         while True:
             try:
-                # Lấy text từ queue (blocking cho đến khi có)
-                text = self.speech_queue.get()
-                
-                # Kiểm tra xem âm thanh có bật không
-                if not self.enable_sound:
-                    self.speech_queue.task_done()
-                    continue
-                
-                self.is_speaking = True
-                temp_file = None
-                
-                try:
-                    # Tạo file âm thanh
-                    tts = gTTS(text=text, lang='vi', slow=False)
-                    temp_file = f"temp_audio_{int(time.time()*1000)}.mp3"
-                    tts.save(temp_file)
-                    
-                    # Phát âm thanh
-                    pygame.mixer.music.load(temp_file)
-                    pygame.mixer.music.play()
-                    
-                    # Đợi phát xong - kiểm tra enable_sound liên tục
-                    while pygame.mixer.music.get_busy():
-                        if not self.enable_sound:
-                            # Nếu tắt âm thanh giữa chừng, dừng ngay
-                            pygame.mixer.music.stop()
-                            break
-                        pygame.time.Clock().tick(10)
-                    
-                    # Đợi một chút để đảm bảo phát xong
-                    if self.enable_sound:
-                        time.sleep(0.2)
-                    
-                except Exception as e:
-                    print(f"Lỗi khi phát âm: {e}")
-                finally:
-                    # Xóa file tạm
-                    if temp_file and os.path.exists(temp_file):
-                        try:
-                            pygame.mixer.music.unload()
-                            time.sleep(0.1)
-                            os.remove(temp_file)
-                        except Exception as e:
-                            print(f"Không thể xóa file tạm: {e}")
-                    
-                    self.is_speaking = False
-                    # Đánh dấu task hoàn thành
-                    self.speech_queue.task_done()
-                    
+                # Lấy câu ưu tiên cao nhất còn hạn (blocking cho đến khi có) rồi phát
+                self.speak_next(pygame)
             except Exception as e:
                 print(f"Lỗi trong speech worker: {e}")
                 self.is_speaking = False
+    
+    def speak_next(self, pygame, timeout=None):
+        """Lấy một câu từ hàng đợi và phát tới khi xong hoặc bị ngắt
+        
+        pygame được truyền vào để benchmark thay được phần phát âm thanh.
+        Trả về False nếu hết timeout mà không có câu nào.
+        """
+        item = self.speech.get(timeout)
+        if item is None:
+            return False
+        text = item['text']
+        preempted = False
+        
+        # Kiểm tra xem âm thanh có bật không
+        if not self.enable_sound:
+            self.speech.done()
+            return True
+        
+        self.is_speaking = True
         
-    def load_model(self):
-        """Tải mô hình YOLO"""
         try:
-            self.model = YOLO('model/best.pt')
-            print("Đã tải mô hình YOLO thành công!")
+            sound = self.audio_cache.get_sound(text)
+            if self.speech.is_expired(item):
+                # Tạo âm thanh quá lâu, biển báo đã đi qua
+                return True
+            if sound is not None:
+                # Phát từ bộ nhớ
+                channel = sound.play()
+                is_busy = channel.get_busy if channel else (lambda: False)
+                stop = sound.stop
+            else:
+                # Mixer không giải mã được mp3 thành Sound: phát qua music từ bộ nhớ
+                pygame.mixer.music.load(io.BytesIO(self.audio_cache.get_mp3(text)), 'mp3')
+                pygame.mixer.music.play()
+                is_busy = pygame.mixer.music.get_busy
+                stop = pygame.mixer.music.stop
+            
+            # Đợi phát xong - kiểm tra enable_sound và câu ưu tiên cao hơn liên tục
+            clock = pygame.time.Clock()
+            while is_busy():
+                if not self.enable_sound:
+                    # Nếu tắt âm thanh giữa chừng, dừng ngay
+                    stop()
+                    break
+                if self.speech.should_stop():
+                    # Nhường cho biển cấm/cảnh báo vừa xuất hiện
+                    stop()
+                    preempted = True
+                    break
+                clock.tick(20)
+            
         except Exception as e:
-            messagebox.showerror("Lỗi", f"Không thể tải mô hình YOLO: {str(e)}")
-            self.model = None
+            print(f"Lỗi khi phát âm: {e}")
+        finally:
+            self.is_speaking = False
+            self.speech.done(preempted)
+        return True
+        
+    def load_model(self):
+        """Tải mô hình YOLO ở luồng nền, giao diện hiện trạng thái đang tải"""
+        self.model_loading = True
+        self.status_label.config(text="Trạng thái: ⏳ Đang tải mô hình...", fg=self.colors['warning'])
+        self.status_indicator.config(fg=self.colors['warning'])
+        self.window_time = time.perf_counter() - STARTUP_TIME
+        
+        def loader():
+            timings = {}
+            try:
+                start = time.perf_counter()
+                import_yolo()
+                timings['import'] = time.perf_counter() - start
+                
+                start = time.perf_counter()
+                model = load_inference_model(self.model_path, self.backend, preprocess=self.preprocess)
+                timings['load'] = time.perf_counter() - start
+                
+                # Chạy thử trên frame đen để frame thật đầu tiên không bị chậm
+                start = time.perf_counter()
+                predict_detections(model, [np.zeros((TRAIN_IMGSZ, TRAIN_IMGSZ, 3), dtype=np.uint8)])
+                timings['warmup'] = time.perf_counter() - start
+                
+                self.startup_report = timings
+                self.model = model
+            except Exception as e:
+                self.model_error = e
+            finally:
+                self.model_loading = False
+        
+        threading.Thread(target=loader, name="model-loader", daemon=True).start()
+        self.root.after(100, self.check_model_loaded)
+    
+    def check_model_loaded(self):
+        """Kiểm tra (trên luồng chính) xem luồng nền đã tải xong mô hình chưa"""
+        if self.model_loading:
+            self.root.after(100, self.check_model_loaded)
+            return
+        
+        if self.model is None:
+            messagebox.showerror("Lỗi", f"Không thể tải mô hình YOLO: {str(self.model_error)}")
+            self.status_label.config(text="Trạng thái: Không thể tải mô hình",
+                                     fg=self.colors['danger'])
+            self.status_indicator.config(fg=self.colors['danger'])
+            return
+        
+        # Dựng lại danh mục theo lớp của mô hình và tạo sẵn âm thanh thông báo
+        self.catalog = SignCatalog(self.model.names, auto_reload=self.watch_catalog)
+        self.audio_cache.prewarm(self.catalog.announcements())
+        
+        timings = self.startup_report
+        total = time.perf_counter() - STARTUP_TIME
+        report = (f"import {timings['import']:.1f}s, tải mô hình {timings['load']:.1f}s, "
+                  f"warm-up {timings['warmup']:.1f}s")
+        print(f"Khởi động: giao diện hiện sau {self.window_time:.2f}s, {report}, "
+              f"sẵn sàng sau {total:.1f}s (backend: {self.backend})")
+        self.status_label.config(text=f"Trạng thái: Sẵn sàng ({report})",
+                                 fg=self.colors['success'])
+        self.status_indicator.config(fg=self.colors['success'])
+        
+        if self.stream_sources:
+            self.start_streams(self.stream_sources)
+    
+    def check_model_ready(self):
+        """Báo lỗi nếu mô hình chưa sẵn sàng, trả về True nếu dùng được"""
+        if self.model:
+            return True
+        if self.model_loading:
+            messagebox.showinfo("Thông báo", "Mô hình đang được tải, vui lòng đợi trong giây lát.")
+        else:
+            messagebox.showerror("Lỗi", "Mô hình YOLO chưa được tải!")
+        return False
     
     def strip_accents(self, s: str) -> str:
         nf = unicodedata.normalize('NFD', s)
         no_marks = ''.join(c for c in nf if unicodedata.category(c) != 'Mn')
         return no_marks.replace('Đ', 'D').replace('đ', 'd')
 
-    def read_classes_file(self, file_path):
-        """Đọc file classes_vie.txt và trả về danh sách các lớp"""
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                classes_vie = [line.strip() for line in f if line.strip()]
-            return classes_vie
-        except FileNotFoundError:
-            print(f"Không tìm thấy file: {file_path}")
-            return []
-        except Exception as e:
-            print(f"Lỗi khi đọc file {file_path}: {e}")
-            return []
-    
     def setup_styles(self):
         """Thiết lập style cho các widget"""
         style = ttk.Style()
@@ -277,6 +2741,22 @@ class TrafficSignDetectionApp:
                                      width=18)
         self.btn_camera.pack(side=tk.LEFT, padx=10)
         
+        # Nút mở luồng mạng (camera IP)
+        btn_url = ttk.Button(button_frame,
+                             text="🌐 Mở URL",
+                             command=self.select_url,
+                             style='Primary.TButton',
+                             width=18)
+        btn_url.pack(side=tk.LEFT, padx=10)
+        
+        # Nút mở nhiều nguồn cùng lúc (hiển thị dạng lưới)
+        btn_streams = ttk.Button(button_frame,
+                                 text="🎥 Nhiều nguồn",
+                                 command=self.select_streams,
+                                 style='Primary.TButton',
+                                 width=18)
+        btn_streams.pack(side=tk.LEFT, padx=10)
+        
         # Nút pause/resume video
         self.btn_pause = ttk.Button(button_frame,
                                     text="⏸ Pause",
@@ -433,13 +2913,26 @@ class TrafficSignDetectionApp:
                                      bg=self.colors['bg_secondary'],
                                      fg=self.colors['text_secondary'])
         self.status_label.pack(side=tk.LEFT)
+        
+        self.fps_label = tk.Label(status_frame,
+                                  text="",
+                                  font=('Segoe UI', 10),
+                                  bg=self.colors['bg_secondary'],
+                                  fg=self.colors['text_secondary'])
+        self.fps_label.pack(side=tk.RIGHT, padx=20)
     
     def select_video(self):
         """Chọn file video"""
+        # Kiểm tra trước khi dừng nguồn cũ hay đổi trạng thái: mô hình có thể vẫn đang tải
+        if not self.check_model_ready():
+            return
+        self.stop_streams()
+        
         # Dừng video cũ nếu đang chạy
         if self.is_video_active:
             self.is_video_active = False
             self.is_paused = False
+            self.stop_pipeline()
             self.btn_pause.config(state='disabled', text="⏸ Pause")
             if self.cap:
                 self.cap.release()
@@ -488,6 +2981,9 @@ class TrafficSignDetectionApp:
             self.status_label.config(text="Trạng thái: Video đã tạm dừng", 
                                    fg=self.colors['warning'])
         else:
+            if self.video_reader:
+                # Tính lại lịch phát từ frame kế tiếp, không bỏ frame để bù thời gian tạm dừng
+                self.video_reader.clock.reset()
             self.btn_pause.config(text="⏸ Pause")
             self.status_label.config(text=f"Trạng thái: Đang xử lý video - {os.path.basename(self.video_path)}", 
                                    fg=self.colors['primary'])
@@ -511,21 +3007,26 @@ class TrafficSignDetectionApp:
             self.btn_toggle_sound.config(text="🔇 Bật Âm thanh")
             # Dừng âm thanh đang phát ngay lập tức
             try:
+                import pygame
+                pygame.mixer.stop()
                 pygame.mixer.music.stop()
             except:
                 pass
             # Xóa toàn bộ queue để không phát nữa
-            while not self.speech_queue.empty():
-                try:
-                    self.speech_queue.get_nowait()
-                    self.speech_queue.task_done()
-                except:
-                    break
+            self.speech.clear()
     
     def change_video_speed(self, event=None):
         """Thay đổi tốc độ video"""
         speed_text = self.speed_var.get()
         self.video_speed = float(speed_text.replace('x', ''))
+        if self.is_video_active and self.video_reader:
+            self.video_reader.stride = StridedVideoReader.stride_for_speed(self.video_speed)
+            self.video_reader.clock.set_speed(self.video_speed)
+            self.scheduler.target_fps = self.source_fps * self.video_speed / self.video_reader.stride
+        for stream in self.streams:
+            if stream.reader is not None:
+                stream.reader.stride = StridedVideoReader.stride_for_speed(self.video_speed)
+                stream.reader.clock.set_speed(self.video_speed)
         if self.is_video_active or self.is_camera_active:
             status_text = f"Trạng thái: Tốc độ video {speed_text}"
             self.status_label.config(text=status_text, fg=self.colors['primary'])
@@ -534,46 +3035,85 @@ class TrafficSignDetectionApp:
         """Xóa sạch tất cả dữ liệu và widget"""
         # Xóa lịch sử phát hiện
         self.detected_history.clear()
-        self.detection_buffer.clear()
+        self.stabilizer.clear()
         self.sign_popup_text.clear()
         
         # Xóa tất cả widget ảnh biển báo
-        for label, data in list(self.sign_images.items()):
+        for data in list(self.sign_images.values()) + self.crop_store.take_evicted():
             if 'widget' in data and data['widget']:
                 try:
                     data['widget'].destroy()
                 except:
                     pass
-        self.sign_images.clear()
+        self.crop_store.clear()
         
         # Cập nhật log
         self.update_detection_log()
     
     def start_camera(self):
         """Bắt đầu sử dụng camera"""
+        # Kiểm tra trước khi mở nguồn hay đổi trạng thái: mô hình có thể vẫn đang tải
+        if not self.check_model_ready():
+            return
+        self.stop_streams()
         if self.is_video_active:
             self.is_video_active = False
             self.is_paused = False
             self.btn_pause.config(state='disabled', text="⏸ Pause")
+            self.stop_pipeline()
         
         # Xóa sạch dữ liệu cũ
         self.clear_all_data()
         
-        self.cap = cv2.VideoCapture(0)
+        self.cap = open_capture(self.camera_source, on_status=self.on_stream_status)
         if not self.cap.isOpened():
-            messagebox.showerror("Lỗi", "Không thể mở camera!")
+            self.cap.release()
+            self.cap = None
+            messagebox.showerror("Lỗi", f"Không thể mở nguồn: {self.camera_source}")
             return
         
         self.is_camera_active = True
         self.btn_camera.config(text="📷 Tắt Camera")
-        self.status_label.config(text="Trạng thái: Đang sử dụng camera", 
+        source_text = self.camera_source if is_url(self.camera_source) else "camera"
+        self.status_label.config(text=f"Trạng thái: Đang sử dụng {source_text}", 
                                fg=self.colors['success'])
         self.status_indicator.config(fg=self.colors['success'])
         self.process_camera()
     
+    def select_url(self):
+        """Nhập URL camera IP (RTSP/HTTP) rồi chạy như camera"""
+        if not self.check_model_ready():
+            return
+        url = simpledialog.askstring("Mở URL", "Nhập URL luồng video (rtsp://, http://...):",
+                                     initialvalue=self.camera_source if is_url(self.camera_source) else "",
+                                     parent=self.root)
+        if url and url.strip():
+            if self.is_camera_active:
+                self.stop_camera()
+            self.camera_source = url.strip()
+            self.start_camera()
+    
+    def on_stream_status(self, grabber, status):
+        """Trạng thái kết nối của luồng mạng (gọi từ luồng đọc)"""
+        self.ui.post('stream_status', (grabber, status))
+    
+    def show_stream_status(self, state):
+        grabber, status = state
+        if not self.is_camera_active or self.cap is not grabber:
+            return
+        if status == 'connected':
+            text, color = f"Trạng thái: Đang sử dụng {grabber.url}", self.colors['success']
+        elif status == 'reconnecting':
+            text, color = f"Trạng thái: Mất kết nối {grabber.url}, đang kết nối lại...", self.colors['warning']
+        else:
+            text, color = f"Trạng thái: Đang kết nối {grabber.url}...", self.colors['warning']
+        self.status_label.config(text=text, fg=color)
+        self.status_indicator.config(fg=color)
+    
     def stop_camera(self):
         """Dừng camera"""
         self.is_camera_active = False
+        self.stop_pipeline()
         if self.cap:
             self.cap.release()
             self.cap = None
@@ -586,16 +3126,16 @@ class TrafficSignDetectionApp:
         self.clear_all_data()
         
         # Reset màn hình về đen
-        self.video_label.config(image='', 
-                               text="Chưa có video\n\nChọn video hoặc bật camera để bắt đầu",
-                               fg=self.colors['text_secondary'],
-                               bg="#000000")
+        self.clear_video_display()
     
     def stop_all(self):
         """Dừng tất cả"""
+        self.stop_streams()
+        
         # Dừng video
         self.is_video_active = False
         self.is_paused = False
+        self.stop_pipeline()
         self.btn_pause.config(state='disabled', text="⏸ Pause")
         
         # Dừng camera
@@ -610,156 +3150,293 @@ class TrafficSignDetectionApp:
         self.clear_all_data()
         
         # Reset màn hình về đen
-        self.video_label.config(image='', 
-                               text="Chưa có video\n\nChọn video hoặc bật camera để bắt đầu",
-                               fg=self.colors['text_secondary'],
-                               bg="#000000")
+        self.clear_video_display()
         
         self.status_label.config(text="Trạng thái: Đã dừng", 
                                fg=self.colors['text_secondary'])
         self.status_indicator.config(fg=self.colors['text_secondary'])
     
+    def stop_pipeline(self):
+        """Dừng pipeline đang chạy (nếu có)"""
+        if self.pipeline:
+            self.pipeline.stop()
+            self.pipeline = None
+    
     def process_video(self):
         """Xử lý video file"""
-        if not self.model:
-            messagebox.showerror("Lỗi", "Mô hình YOLO chưa được tải!")
+        if not self.check_model_ready():
             return
         
-        def video_thread():
-            cap = cv2.VideoCapture(self.video_path)
-            if not cap.isOpened():
-                messagebox.showerror("Lỗi", "Không thể mở file video!")
-                self.is_video_active = False
-                return
-            
-            fps = int(cap.get(cv2.CAP_PROP_FPS))
-            delay = 1.0 / fps if fps > 0 else 0.033  # delay tính bằng giây
-            
-            while self.is_video_active:
-                if not self.is_paused:
-                    ret, frame = cap.read()
-                    if not ret:
-                        break
-                    
-                    frame = self.detect_traffic_signs(frame)
-                    self.display_frame(frame)
-                    
-                    # Điều chỉnh delay theo tốc độ video
-                    adjusted_delay = delay / self.video_speed
-                    time.sleep(max(0.001, adjusted_delay))
-                else:
-                    time.sleep(0.1)
-            
+        cap = cv2.VideoCapture(self.video_path)
+        if not cap.isOpened():
+            messagebox.showerror("Lỗi", "Không thể mở file video!")
+            self.is_video_active = False
+            return
+        
+        self.source_fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        # Giữ nhịp theo thời điểm của frame; phát nhanh chỉ lấy ảnh 1 trong stride frame,
+        # frame đã trễ lịch bị bỏ qua ngay ở luồng capture
+        clock = PlaybackClock(self.video_speed, self.source_fps)
+        reader = StridedVideoReader(cap, StridedVideoReader.stride_for_speed(self.video_speed), clock)
+        self.video_reader = reader
+        self.scheduler.reset(self.source_fps * self.video_speed / reader.stride)
+        self.change_detector.reset()
+        
+        def on_finish():
             cap.release()
+            if self.pipeline is not pipeline:
+                # Pipeline đã được thay bằng nguồn khác
+                return
+            self.pipeline = None
             self.is_video_active = False
             self.is_paused = False
-            self.btn_pause.config(state='disabled', text="⏸ Pause")
-            self.status_label.config(text="Trạng thái: Video đã kết thúc", 
-                                   fg=self.colors['text_secondary'])
-            self.status_indicator.config(fg=self.colors['text_secondary'])
-        
-        thread = threading.Thread(target=video_thread, daemon=True)
-        thread.start()
+            self.ui.post('video_finished', pipeline)
+        
+        # Video file: không bỏ frame, giữ nhịp phát theo fps và tốc độ
+        pipeline = FramePipeline(read_frame=reader.read,
+                                 process_frame=self.detect_traffic_signs,
+                                 render_frame=self.display_frame,
+                                 drop_policy=DROP_LOSSLESS,
+                                 queue_size=VIDEO_PREFETCH_FRAMES,
+                                 is_active=lambda: self.is_video_active,
+                                 is_paused=lambda: self.is_paused,
+                                 clock=clock,
+                                 frame_time=lambda: reader.position,
+                                 on_finish=on_finish,
+                                 name="video",
+                                 metrics=self.metrics)
+        self.stop_pipeline()
+        self.pipeline = pipeline
+        pipeline.start()
+    
+    def show_video_finished(self, pipeline):
+        if self.pipeline is not None or self.is_video_active:
+            # Đã chuyển sang nguồn khác trước khi kịp vẽ
+            return
+        self.btn_pause.config(state='disabled', text="⏸ Pause")
+        self.status_label.config(text="Trạng thái: Video đã kết thúc", 
+                               fg=self.colors['text_secondary'])
+        self.status_indicator.config(fg=self.colors['text_secondary'])
     
     def process_camera(self):
         """Xử lý camera"""
-        if not self.model:
-            messagebox.showerror("Lỗi", "Mô hình YOLO chưa được tải!")
+        if not self.check_model_ready():
             return
         
-        def camera_thread():
-            while self.is_camera_active and self.cap:
-                ret, frame = self.cap.read()
-                if not ret:
-                    break
-                
-                frame = self.detect_traffic_signs(frame)
-                self.display_frame(frame)
-            
-            if self.cap:
-                self.cap.release()
+        cap = self.cap
+        # Giảm buffer nội bộ của OpenCV để không đọc phải frame cũ
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        self.source_fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        self.scheduler.reset(self.source_fps)
+        self.change_detector.reset()
         
-        thread = threading.Thread(target=camera_thread, daemon=True)
-        thread.start()
+        def on_finish():
+            cap.release()
+            if self.pipeline is pipeline:
+                self.pipeline = None
+        
+        # Camera: chỉ giữ frame mới nhất để độ trễ hiển thị luôn bị chặn
+        pipeline = FramePipeline(read_frame=cap.read,
+                                 process_frame=self.detect_traffic_signs,
+                                 render_frame=self.display_frame,
+                                 drop_policy=DROP_LATEST,
+                                 queue_size=1,
+                                 is_active=lambda: self.is_camera_active and self.cap is cap,
+                                 on_finish=on_finish,
+                                 name="camera",
+                                 metrics=self.metrics)
+        self.stop_pipeline()
+        self.pipeline = pipeline
+        pipeline.start()
+    
+    def select_streams(self):
+        """Hỏi danh sách nguồn rồi chạy chế độ nhiều nguồn"""
+        if not self.check_model_ready():
+            return
+        text = simpledialog.askstring("Nhiều nguồn",
+                                      "Nhập các nguồn, cách nhau bởi dấu phẩy\n"
+                                      "(số = chỉ số camera, còn lại = đường dẫn video):",
+                                      initialvalue=", ".join(self.stream_sources) or "0, 1",
+                                      parent=self.root)
+        if text:
+            sources = [part.strip() for part in text.split(',') if part.strip()]
+            if sources:
+                self.stream_sources = sources
+                self.start_streams(sources)
+    
+    def start_streams(self, sources):
+        """Chạy nhiều nguồn cùng lúc, dùng chung một mô hình và gom frame thành lô"""
+        if not self.check_model_ready():
+            return
+        self.stop_all()
+        
+        cols = int(np.ceil(np.sqrt(len(sources))))
+        rows = int(np.ceil(len(sources) / cols))
+        cell_size = (DISPLAY_MAX_WIDTH // cols, DISPLAY_MAX_HEIGHT // rows)
+        self.batcher = SharedBatchInference(self.model, self.tiling, max_batch=len(sources),
+                                            metrics=self.metrics)
+        with self.display_lock:
+            self.grid_canvas = np.zeros((cell_size[1] * rows, cell_size[0] * cols, 3), dtype=np.uint8)
+            self.grid_dirty = True
+        self.is_multi_active = True
+        self.batcher.start()
+        
+        for stream_id, source in enumerate(sources):
+            cap = open_capture(source)
+            if not cap.isOpened():
+                cap.release()
+                print(f"Không thể mở nguồn: {source}")
+                continue
+            stream = VideoStream(stream_id, source, cap, self.batcher, cell_size,
+                                 on_stable=self.on_stream_stable)
+            self.batcher.register(stream_id)
+            cell = (stream_id % cols * cell_size[0], stream_id // cols * cell_size[1])
+            if stream.is_camera:
+                # Camera: chỉ giữ frame mới nhất
+                cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+                options = {'read_frame': cap.read, 'drop_policy': DROP_LATEST, 'queue_size': 1}
+            else:
+                # Video file: giữ nhịp phát theo thời điểm của frame, bỏ frame trễ lịch
+                clock = PlaybackClock(self.video_speed, stream.fps)
+                stream.reader = StridedVideoReader(
+                    cap, StridedVideoReader.stride_for_speed(self.video_speed), clock)
+                options = {'read_frame': stream.reader.read, 'drop_policy': DROP_LOSSLESS,
+                           'queue_size': VIDEO_PREFETCH_FRAMES, 'clock': clock,
+                           'frame_time': lambda reader=stream.reader: reader.position}
+            stream.pipeline = FramePipeline(
+                process_frame=stream.process,
+                render_frame=lambda frame, cell=cell: self.display_grid_frame(cell, frame),
+                is_active=lambda: self.is_multi_active,
+                on_finish=lambda stream=stream: self.on_stream_finished(stream),
+                name=f"stream{stream_id + 1}",
+                metrics=self.metrics,
+                **options)
+            self.streams.append(stream)
+            stream.pipeline.start()
+        
+        if not self.streams:
+            messagebox.showerror("Lỗi", "Không mở được nguồn nào!")
+            self.stop_streams()
+            return
+        self.status_label.config(text=f"Trạng thái: Đang chạy {len(self.streams)} nguồn",
+                                 fg=self.colors['success'])
+        self.status_indicator.config(fg=self.colors['success'])
+    
+    def on_stream_stable(self, stream, det, frame):
+        """Biển báo ổn định mới ở một nguồn (gọi từ luồng inference của nguồn đó)"""
+        sign_info = self.catalog.get(det['cls_id'])
+        self.metrics.inc(METRIC_STABLE_EVENTS, label=det['label'], code=sign_info['prefix'])
+        pipeline = stream.pipeline
+        if pipeline.current_media_time is not None:
+            frame_index = int(round(pipeline.current_media_time * stream.fps))
+        else:
+            frame_index = pipeline.get_stats()['processed']
+        self.record_event(det, sign_info, frame, stream.source, frame_index)
+        self.speak_text(sign_info['announcement'], sign_info['category'])
+        if det['label'] not in self.detected_history:
+            self.detected_history.insert(0, det['label'])
+            self.update_detection_log()
+        self.set_info(f"✅ {stream.name}: {sign_info['name']}", self.colors['success'])
+    
+    def on_stream_finished(self, stream):
+        stream.cap.release()
+        if self.batcher is stream.batcher:
+            self.batcher.unregister(stream.stream_id)
+    
+    def stop_streams(self):
+        """Dừng chế độ nhiều nguồn (nếu đang chạy)"""
+        if not self.streams and self.batcher is None:
+            return
+        self.is_multi_active = False
+        for stream in self.streams:
+            stream.pipeline.stop()
+        if self.batcher:
+            self.batcher.stop()
+        self.streams = []
+        self.batcher = None
+        with self.display_lock:
+            self.grid_canvas = None
+            self.grid_dirty = False
+        self.clear_video_display()
+    
+    def display_grid_frame(self, cell, frame):
+        """Chép frame của một nguồn vào ô của lưới (gọi từ luồng render của nguồn đó)"""
+        x, y = cell
+        height, width = frame.shape[:2]
+        with self.display_lock:
+            if self.grid_canvas is None:
+                return
+            self.grid_canvas[y:y + height, x:x + width] = frame
+            self.grid_dirty = True
+            self.display_stats['posted'] += 1
+    
+    def set_info(self, text, fg):
+        """Đổi dòng thông báo (gọi được từ luồng worker)"""
+        self.ui.post('info', (text, fg))
+    
+    def show_info(self, state):
+        text, fg = state
+        self.info_label.config(text=text, fg=fg)
     
     def update_detection_log(self):
-        """Cập nhật log biển báo đã phát hiện"""
-        classesVie = self.read_classes_file('classes_vie.txt')
-        if not self.detected_history:
+        """Cập nhật log biển báo đã phát hiện (gọi được từ luồng worker)"""
+        self.ui.post('log', tuple(self.detected_history))
+    
+    def render_detection_log(self, detected_history):
+        """Dựng lại nội dung log, chỉ gọi khi danh sách thay đổi"""
+        if not detected_history:
             log_text = "Log: Chưa phát hiện"
         else:
             log_lines = ["=== LOG BIỂN BÁO ==="]
-            for sign in self.detected_history:
-                if int(sign) < len(classesVie):
-                    log_lines.append(f"✓ {sign} {classesVie[int(sign)]}")
+            for sign in detected_history:
+                entry = self.catalog.get_by_label(sign)
+                if entry['name'] != sign:
+                    log_lines.append(f"✓ {sign} {entry['name']}")
                 else:
                     log_lines.append(f"✓ {sign}")
             log_text = "\n".join(log_lines)
         self.overlay_panel.config(text=log_text)
     
-    def is_detection_stable(self, label):
-        """Kiểm tra xem detection có ổn định hay không - đã cải tiến"""
-        current_time = time.time()
-        timestamps = self.detection_buffer[label]
-        
-        # Lọc bỏ timestamp quá cũ
-        timestamps = [t for t in timestamps if current_time - t < self.buffer_timeout]
-        self.detection_buffer[label] = timestamps
-        
-        # Kiểm tra có đủ số lần phát hiện tối thiểu không
-        if len(timestamps) < self.min_detections:
-            return False
-        
-        # Kiểm tra khoảng thời gian từ lần phát hiện đầu tiên
-        time_span = current_time - timestamps[0]
-        return time_span >= self.stable_duration
-    
-    def add_detection_to_buffer(self, label):
-        """Thêm detection vào buffer"""
-        current_time = time.time()
-        self.detection_buffer[label].append(current_time)
-    
     def update_sign_images_display(self):
         """Cập nhật hiển thị ảnh biển báo"""
         current_time = time.time()
-        labels_to_remove = []
+        tracks_to_remove = []
+        
+        for data in self.crop_store.take_evicted():
+            if data.get('widget'):
+                data['widget'].destroy()
         
-        for label, data in list(self.sign_images.items()):
+        for track_id, data in list(self.sign_images.items()):
             if current_time - data['last_seen'] > self.display_duration:
                 if 'widget' in data and data['widget']:
                     data['widget'].destroy()
-                labels_to_remove.append(label)
+                tracks_to_remove.append(track_id)
                 continue
             
             if current_time - data['first_stable'] < self.capture_delay:
                 continue
             
+            if data.get('widget') is not None and data['widget_version'] != data['version']:
+                # Đã có ảnh đẹp hơn: vẽ lại
+                data['widget'].destroy()
+                data['widget'] = None
+            
             if 'widget' not in data or data['widget'] is None:
                 try:
                     img_frame = tk.Frame(self.sign_images_container, bg="#1a1a1a", bd=1, relief=tk.SOLID)
                     img_frame.pack(side=tk.LEFT, padx=3, pady=3)
                     
+                    # Ảnh đã được thu nhỏ về kích thước thumbnail lúc chụp
+                    data['widget_version'] = data['version']
                     img_rgb = cv2.cvtColor(data['image'], cv2.COLOR_BGR2RGB)
-                    img_pil = Image.fromarray(img_rgb)
-                    
-                    max_size = 80
-                    img_pil.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
-                    
-                    photo = ImageTk.PhotoImage(img_pil)
+                    photo = ImageTk.PhotoImage(Image.fromarray(img_rgb))
                     
                     img_label = tk.Label(img_frame, image=photo, bg="#1a1a1a")
                     img_label.image = photo
                     img_label.pack()
                     
                     # Lấy mã ký tự từ file label (ví dụ: R415_xxxxxxx -> R415)
-                    display_text = label
-                    if self.class_labels and int(label) < len(self.class_labels):
-                        label_code = self.class_labels[int(label)]
-                        # Lấy cụm ký tự trước dấu _ đầu tiên
-                        if '_' in label_code:
-                            display_text = label_code.split('_')[0]
-                        else:
-                            display_text = label_code
+                    display_text = self.catalog.get_by_label(data['label'])['prefix']
                     
                     name_label = tk.Label(img_frame, 
                                         text=display_text,
@@ -773,74 +3450,22 @@ class TrafficSignDetectionApp:
                 except Exception as e:
                     print(f"Lỗi hiển thị ảnh: {e}")
         
-        for label in labels_to_remove:
-            del self.sign_images[label]
+        for track_id in tracks_to_remove:
+            self.crop_store.remove(track_id)
     
-    def crop_sign_image(self, frame, box):
-        """Cắt ảnh biển báo"""
+    def crop_sign_image(self, frame, box, max_size=None):
+        """Cắt ảnh biển báo, thu nhỏ về max_size nếu có"""
         try:
-            x1, y1, x2, y2 = box
-            x1, y1, x2, y2 = int(x1), int(y1), int(x2), int(y2)
-            
-            h, w = frame.shape[:2]
-            x1 = max(0, x1)
-            y1 = max(0, y1)
-            x2 = min(w, x2)
-            y2 = min(h, y2)
-            
-            cropped = frame[y1:y2, x1:x2].copy()
-            return cropped
+            return crop_thumbnail(frame, box, max_size)
         except Exception as e:
             print(f"Lỗi khi cắt ảnh: {e}")
             return None
     
-    def get_sign_color(self, label_index):
-        """Lấy màu theo loại biển báo"""
-        try:
-            if self.class_labels and int(label_index) < len(self.class_labels):
-                label_code = self.class_labels[int(label_index)]
-                first_char = label_code[0].upper()
-                
-                if first_char == 'P':
-                    return (220, 20, 60)
-                elif first_char == 'W':
-                    return (255, 140, 0)
-                elif first_char == 'R':
-                    return (135, 206, 250)
-                elif first_char == 'I':
-                    return (30, 144, 255)
-                else:
-                    return (0, 200, 0)
-            else:
-                return (0, 200, 0)
-        except:
-            return (0, 200, 0)
-    
-    def draw_popup_notifications(self, frame):
-        """Vẽ popup thông báo"""
+    def draw_popup_notifications(self, img, scale, source_width):
+        """Vẽ popup thông báo lên ảnh đã thu nhỏ"""
         current_time = time.time()
         labels_to_remove = []
-        
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        pil_img = Image.fromarray(frame_rgb)
-        draw = ImageDraw.Draw(pil_img)
-        
-        y_offset = 130
-        
-        frame_h, frame_w = pil_img.size[1], pil_img.size[0]
-        # Tính toán kích thước chữ động dựa trên chiều rộng video
-        dynamic_font_size = max(40, min(100, int(frame_w * 0.06)))
-        
-        try:
-            font = ImageFont.truetype("arial.ttf", dynamic_font_size)
-        except:
-            try:
-                font = ImageFont.truetype("C:\\Windows\\Fonts\\arial.ttf", dynamic_font_size)
-            except:
-                try:
-                    font = ImageFont.truetype("C:\\Windows\\Fonts\\arialbd.ttf", dynamic_font_size)
-                except:
-                    font = ImageFont.load_default()
+        banners = []
         
         for label, data in self.sign_popup_text.items():
             if current_time - data['first_stable'] < self.capture_delay:
@@ -850,217 +3475,597 @@ class TrafficSignDetectionApp:
                 labels_to_remove.append(label)
                 continue
             
-            text = f"🚦 {data['text']}"
-            bg_color = self.get_sign_color(label)
-            
-            bbox = draw.textbbox((0, 0), text, font=font)
-            text_width = bbox[2] - bbox[0]
-            text_height = bbox[3] - bbox[1]
-            
-            frame_h, frame_w = pil_img.size[1], pil_img.size[0]
-            x = (frame_w - text_width) // 2
-            y = y_offset
-            
-            padding = 25
-            draw.rectangle(
-                [(x - padding, y - padding),
-                 (x + text_width + padding, y + text_height + padding)],
-                fill=bg_color,
-                outline=(255, 255, 255),
-                width=6
-            )
-            
-            draw.text((x, y), text, font=font, fill=(255, 255, 255))
-            
-            y_offset += text_height + 2 * padding + 20
+            banners.append((f"🚦 {data['text']}", self.catalog.get_by_label(label)['color']))
         
         for label in labels_to_remove:
             del self.sign_popup_text[label]
         
-        frame_result = cv2.cvtColor(np.array(pil_img), cv2.COLOR_RGB2BGR)
-        return frame_result
+        if banners:
+            self.overlay.draw_banners(img, banners, scale, source_width)
+        return img
 
     def detect_traffic_signs(self, frame):
         """Nhận diện biển báo - đã tối ưu"""
         if self.model is None:
             return frame
         try:
-            # Tăng confidence threshold lên 0.4 để chỉ phát hiện biển báo có độ tin cậy cao
-            results = self.model(frame, conf=0.7, verbose=False)
-            detections = results[0].boxes
-            annotated = frame.copy()
+            stage_start = time.perf_counter()
+            if self.catalog.reload_if_changed():
+                self.audio_cache.prewarm(self.catalog.announcements())
             
-            current_time = time.time()
-            detected_labels_this_frame = set()
+            if self.scheduler.should_infer():
+                current_time = time.time()
+                if self.change_detector.has_changed(frame, current_time):
+                    # Tăng confidence threshold lên 0.4 để chỉ phát hiện biển báo có độ tin cậy cao
+                    infer_start = time.perf_counter()
+                    detections = self.tiling.predict(self.model, [frame])[0]
+                    latency = time.perf_counter() - infer_start
+                    self.scheduler.record_latency(latency)
+                    self.metrics.observe(METRIC_MODEL_LATENCY, latency, backend=self.backend,
+                                         mode=self.tiling.mode)
+                    current_time = time.time()
+                    self.last_detections = detections
+                    reused = False
+                else:
+                    # Cảnh gần như không đổi: dùng lại kết quả nhận diện trước (giữ track id).
+                    # Không tính là lần phát hiện mới, để biển báo vẫn phải được mô hình
+                    # xác nhận đủ min_detections lần mới ổn định
+                    detections = [dict(det) for det in self.last_detections]
+                    reused = True
+                stage_start = self.observe_stage('inference', stage_start)
+                stable_flags, new_stable = self.stabilizer.update(detections, current_time,
+                                                                  propagated=reused)
+            else:
+                # Frame giữa 2 lần nhận diện: nội suy box theo chuyển động của track
+                current_time = time.time()
+                detections = self.stabilizer.propagate(current_time)
+                stage_start = self.observe_stage('inference', stage_start)
+                stable_flags, new_stable = self.stabilizer.update(detections, current_time,
+                                                                  propagated=True)
+            new_stable_tracks = {det['track_id'] for det in new_stable}
             
             if len(detections) > 0:
                 current_signs = []
                 stable_signs = []
+                boxes_to_draw = []
                 
-                for box in detections:
-                    x1, y1, x2, y2 = box.xyxy[0].tolist()
-                    cls_id = int(box.cls[0])
-                    conf = float(box.conf[0])
-                    
-                    label = self.model.names.get(cls_id, f"cls_{cls_id}")
+                for det, is_stable in zip(detections, stable_flags):
+                    x1, y1, x2, y2 = det['box']
+                    conf = det['conf']
+                    label = det['label']
                     current_signs.append(label)
-                    detected_labels_this_frame.add(label)
-                    
-                    self.add_detection_to_buffer(label)
-                    is_stable = self.is_detection_stable(label)
                     
                     if is_stable:
-                        # Cắt ảnh biển báo
-                        cropped_img = self.crop_sign_image(frame, (x1, y1, x2, y2))
+                        track_id = det['track_id']
                         
                         # Lấy tên tiếng Việt
-                        classesVie = self.read_classes_file('classes_vie.txt')
-                        if classesVie and int(label) < len(classesVie):
-                            name_vie = classesVie[int(label)]
-                        else:
-                            name_vie = label
+                        sign_info = self.catalog.get(det['cls_id'])
+                        name_vie = sign_info['name']
                         
                         if label not in self.detected_history:
-                            # Lần đầu phát hiện - thêm vào lịch sử
+                            # Lần đầu phát hiện loại biển này - thêm vào lịch sử
                             self.detected_history.insert(0, label)
-                            
-                            if cropped_img is not None:
-                                self.sign_images[label] = {
-                                    'image': cropped_img,
-                                    'first_stable': current_time,
-                                    'last_seen': current_time,
-                                    'last_captured': current_time,
-                                    'widget': None
-                                }
-                            
+                        
+                        if track_id in new_stable_tracks:
+                            # Mỗi biển báo (track) chỉ được thông báo một lần
+                            self.speak_text(sign_info['announcement'], sign_info['category'])
+                            self.metrics.inc(METRIC_STABLE_EVENTS, label=label, code=sign_info['prefix'])
+                            self.record_event(det, sign_info, frame)
+                        
+                        # Ảnh biển báo lưu theo từng track, chỉ thay khi góc nhìn mới đẹp hơn
+                        self.crop_store.update(track_id, label, frame, det['box'], conf, current_time)
+                        
+                        # LUÔN cập nhật popup text để tiếp tục hiển thị
+                        if label in self.sign_popup_text:
+                            self.sign_popup_text[label]['last_seen'] = current_time
+                        else:
                             self.sign_popup_text[label] = {
                                 'text': name_vie,
                                 'first_stable': current_time,
                                 'last_seen': current_time
                             }
-                            
-                            self.speak_text(f"Phát hiện {name_vie}")
-                        else:
-                            # Phát hiện lại - LUÔN cập nhật để hiển thị
-                            if label in self.sign_images:
-                                time_since_last_capture = current_time - self.sign_images[label].get('last_captured', 0)
-                                
-                                # Chỉ chụp lại ảnh nếu đã qua 5 giây
-                                if time_since_last_capture >= self.recapture_interval:
-                                    if cropped_img is not None:
-                                        # Hủy widget cũ
-                                        if 'widget' in self.sign_images[label] and self.sign_images[label]['widget']:
-                                            try:
-                                                self.sign_images[label]['widget'].destroy()
-                                            except:
-                                                pass
-                                        
-                                        # Cập nhật ảnh mới
-                                        self.sign_images[label] = {
-                                            'image': cropped_img,
-                                            'first_stable': self.sign_images[label]['first_stable'],
-                                            'last_seen': current_time,
-                                            'last_captured': current_time,
-                                            'widget': None
-                                        }
-                                else:
-                                    # Chưa đủ 5s, chỉ cập nhật last_seen
-                                    self.sign_images[label]['last_seen'] = current_time
-                            else:
-                                # Trường hợp ảnh bị mất khỏi dictionary, tạo lại
-                                if cropped_img is not None:
-                                    self.sign_images[label] = {
-                                        'image': cropped_img,
-                                        'first_stable': current_time,
-                                        'last_seen': current_time,
-                                        'last_captured': current_time,
-                                        'widget': None
-                                    }
-                            
-                            # LUÔN cập nhật popup text để tiếp tục hiển thị
-                            if label in self.sign_popup_text:
-                                self.sign_popup_text[label]['last_seen'] = current_time
-                            else:
-                                # Tạo lại popup text nếu bị mất
-                                self.sign_popup_text[label] = {
-                                    'text': name_vie,
-                                    'first_stable': current_time,
-                                    'last_seen': current_time
-                                }
                         
                         stable_signs.append(label)
                     
                     color = (0, 255, 0) if is_stable else (0, 165, 255)
                     status = "✓" if is_stable else "..."
                     text = f"{status} {label} {conf:.2f}"
-                    
-                    cv2.rectangle(annotated, (int(x1), int(y1)), (int(x2), int(y2)), color, 2)
-                    (tw, th), _ = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)
-                    cv2.rectangle(annotated, (int(x1), int(y1)-th-8), (int(x1)+tw+4, int(y1)), color, -1)
-                    cv2.putText(annotated, text, (int(x1)+2, int(y1)-6),
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 0), 2, cv2.LINE_AA)
+                    boxes_to_draw.append((det['box'], color, text))
                 
                 unique_current = list(dict.fromkeys(current_signs))
                 if stable_signs:
                     info_text = f"✅ Phát hiện ổn định: {', '.join(list(dict.fromkeys(stable_signs)))} | Đang phát hiện: {len(detections)}"
                 else:
                     info_text = f"🔄 Đang xác nhận... ({len(detections)} đối tượng)"
-                self.info_label.config(text=info_text, fg=self.colors['success'])
+                self.set_info(info_text, self.colors['success'])
                 
                 self.update_detection_log()
             else:
-                self.info_label.config(text="🔍 Đang quét... Không phát hiện biển báo",
-                                       fg=self.colors['text_secondary'])
-            
-            labels_to_remove = []
-            for label in self.detection_buffer:
-                if label not in detected_labels_this_frame:
-                    timestamps = [t for t in self.detection_buffer[label] 
-                                if current_time - t < self.buffer_timeout]
-                    if not timestamps:
-                        labels_to_remove.append(label)
-                    else:
-                        self.detection_buffer[label] = timestamps
+                self.set_info("🔍 Đang quét... Không phát hiện biển báo", self.colors['text_secondary'])
             
-            for label in labels_to_remove:
-                del self.detection_buffer[label]
+            stage_start = self.observe_stage('postprocess', stage_start)
             
-            annotated = self.draw_popup_notifications(annotated)
-            self.update_sign_images_display()
+            # Thu nhỏ về kích thước hiển thị rồi mới vẽ overlay
+            show_hud = self.show_hud and self.hud_text
+            needs_drawing = bool(detections) or bool(self.sign_popup_text) or bool(show_hud)
+            annotated, scale = self.overlay.fit(frame, writable=needs_drawing)
+            if detections:
+                for box, color, text in boxes_to_draw:
+                    self.overlay.draw_box(annotated, box, scale, color, text)
+            if self.sign_popup_text:
+                annotated = self.draw_popup_notifications(annotated, scale, frame.shape[1])
+            if show_hud:
+                self.overlay.draw_hud(annotated, self.hud_text)
+            self.observe_stage('overlay', stage_start)
             
             return annotated
         except Exception as e:
             print(f"Lỗi khi nhận diện: {str(e)}")
             return frame
     
+    def observe_stage(self, stage, start):
+        """Ghi thời gian của một tầng vào metric, trả về mốc bắt đầu của tầng kế tiếp"""
+        now = time.perf_counter()
+        self.metrics.observe(METRIC_STAGE_SECONDS, now - start, stage=stage)
+        return now
+    
+    def current_source(self):
+        """Nguồn và chỉ số frame đang được nhận diện (gọi từ luồng inference)"""
+        pipeline = self.pipeline
+        if self.is_video_active:
+            source = self.video_path
+        else:
+            source = self.camera_source
+        if pipeline is None:
+            return source, None
+        if pipeline.current_media_time is not None:
+            return source, int(round(pipeline.current_media_time * self.source_fps))
+        return source, pipeline.get_stats()['processed']
+    
+    def record_event(self, det, sign_info, frame, source=None, frame_index=None):
+        """Ghi sự kiện biển báo ổn định kèm ảnh cắt (không chặn luồng nhận diện)"""
+        if self.event_store is None:
+            return
+        if source is None:
+            source, frame_index = self.current_source()
+        crop = self.crop_sign_image(frame, det['box'], self.event_store.thumbnail_size)
+        self.event_store.record(det, sign_info, source, frame_index, crop)
+    
     def display_frame(self, frame):
-        """Hiển thị frame lên GUI"""
+        """Gửi frame sang luồng chính để hiển thị (gọi được từ luồng worker)
+        
+        Chỉ giữ frame mới nhất, frame chưa kịp hiển thị sẽ bị bỏ qua.
+        """
+        with self.display_lock:
+            if self.pending_frame is not None:
+                self.display_stats['skipped'] += 1
+            self.pending_frame = frame
+            self.display_stats['posted'] += 1
+    
+    def display_tick(self):
+        """Vòng lặp hiển thị trên luồng chính của Tk, giới hạn theo display_fps"""
         try:
-            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            
-            height, width = frame_rgb.shape[:2]
-            max_width = 1200
-            max_height = 600
-            
-            if width > max_width or height > max_height:
-                scale = min(max_width / width, max_height / height)
-                new_width = int(width * scale)
-                new_height = int(height * scale)
-                frame_rgb = cv2.resize(frame_rgb, (new_width, new_height))
+            with self.display_lock:
+                frame = self.pending_frame
+                self.pending_frame = None
+                if self.grid_dirty:
+                    frame = self.grid_canvas.copy()
+                    self.grid_dirty = False
+            if frame is not None and (self.is_camera_active or self.is_video_active
+                                      or self.is_multi_active):
+                self.show_frame(frame)
+            now = time.perf_counter()
+            if now - self.ui_last_flush >= self.ui_interval:
+                self.ui_last_flush = now
+                self.ui.flush()
+                self.update_sign_images_display()
+            self.update_fps_label()
+        finally:
+            self.root.after(max(1, int(1000 / self.display_fps)), self.display_tick)
+    
+    def show_frame(self, frame):
+        """Hiển thị frame lên GUI, dùng lại PhotoImage nếu cùng kích thước"""
+        start = time.perf_counter()
+        try:
+            height, width = frame.shape[:2]
+            scale = self.overlay.get_scale(width, height)
+            if scale < 1.0:
+                frame = cv2.resize(frame, (int(width * scale), int(height * scale)))
             
+            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
             image = Image.fromarray(frame_rgb)
-            photo = ImageTk.PhotoImage(image=image)
             
-            self.video_label.config(image=photo, text="", bg="#000000")
-            self.video_label.image = photo
+            if self.photo is not None and (self.photo.width(), self.photo.height()) == image.size:
+                # Cập nhật tại chỗ, không cấp phát ảnh Tk mới
+                self.photo.paste(image)
+            else:
+                self.photo = ImageTk.PhotoImage(image=image)
+                self.video_label.config(image=self.photo, text="", bg="#000000")
+            self.display_stats['shown'] += 1
+            self.metrics.observe(METRIC_STAGE_SECONDS, time.perf_counter() - start, stage='display')
             
         except Exception as e:
             print(f"Lỗi khi hiển thị frame: {str(e)}")
+    
+    def collect_metrics(self):
+        """Cập nhật các gauge/counter đọc từ trạng thái của ứng dụng (gọi lúc scrape)"""
+        self.metrics.set(METRIC_SPEECH_QUEUE, self.speech.qsize())
+        self.metrics.set(METRIC_DISPLAY_SKIPPED, self.display_stats['skipped'])
+        self.metrics.set(METRIC_INFERENCE_INTERVAL, self.scheduler.interval)
+        grabbers = [(self.camera_source, self.cap)] + [(stream.name, stream.cap) for stream in self.streams]
+        for source, cap in grabbers:
+            if isinstance(cap, LatestFrameGrabber):
+                stats = cap.get_stats()
+                self.metrics.set(METRIC_STREAM_AGE, stats['age'] or 0.0, source=source)
+                self.metrics.set(METRIC_STREAM_LATENCY, stats['latency'], source=source)
+                self.metrics.set(METRIC_STREAM_RECONNECTS, stats['reconnects'], source=source)
+    
+    def update_fps_label(self):
+        """Cập nhật FPS nhận diện và FPS hiển thị mỗi giây"""
+        now = time.perf_counter()
+        elapsed = now - self.fps_sample['time']
+        if elapsed < 1.0:
+            return
+        processed = self.pipeline.get_stats()['processed'] if self.pipeline else 0
+        shown = self.display_stats['shown']
+        if self.pipeline and self.pipeline is self.fps_sample['pipeline']:
+            infer_fps = (processed - self.fps_sample['processed']) / elapsed
+            display_fps = (shown - self.fps_sample['shown']) / elapsed
+            text = (f"Nhận diện: {infer_fps:.1f} FPS | Hiển thị: {display_fps:.1f} FPS"
+                    f" | YOLO mỗi {self.scheduler.interval} frame"
+                    f" | Bỏ qua (cảnh tĩnh): {self.change_detector.skipped}")
+            if self.is_video_active and self.video_reader:
+                achieved = self.video_reader.clock.achieved_speed
+                if achieved is not None:
+                    skipped = (self.video_reader.skipped + self.video_reader.late_skipped
+                               + self.pipeline.get_stats()['dropped_late'])
+                    text += (f" | Tốc độ thực: {achieved:.2f}x / {self.video_speed:g}x"
+                             f" (bỏ {skipped} frame)")
+            if isinstance(self.cap, LatestFrameGrabber):
+                stream = self.cap.get_stats()
+                status = "" if stream['connected'] else " (đang kết nối lại)"
+                text += (f" | Luồng{status}: tuổi frame {(stream['age'] or 0) * 1000:.0f} ms, "
+                         f"trễ {stream['latency'] * 1000:.0f} ms, kết nối lại {stream['reconnects']}")
+            self.fps_label.config(text=text)
+            if self.show_hud:
+                latency = (self.scheduler.latency or 0.0) * 1000
+                self.hud_text = (f"{infer_fps:.1f} FPS | disp {display_fps:.1f} | model {latency:.0f} ms"
+                                 f" | k={self.scheduler.interval}"
+                                 f" | drop {self.pipeline.get_stats()['dropped']}")
+        elif not self.pipeline:
+            self.fps_label.config(text="")
+            self.hud_text = ""
+        self.fps_sample = {'time': now, 'processed': processed, 'shown': shown,
+                           'pipeline': self.pipeline}
+    
+    def clear_video_display(self):
+        """Reset màn hình về đen"""
+        with self.display_lock:
+            self.pending_frame = None
+        self.photo = None
+        self.video_label.config(image='', 
+                               text="Chưa có video\n\nChọn video hoặc bật camera để bắt đầu",
+                               fg=self.colors['text_secondary'],
+                               bg="#000000")
+
+def detection_to_json(det, is_stable=None):
+    """Chuyển detection sang dict có thể ghi JSON"""
+    record = {
+        'track_id': det.get('track_id'),
+        'label': det['label'],
+        'conf': round(det['conf'], 4),
+        'box': [round(v, 1) for v in det['box']],
+    }
+    if is_stable is not None:
+        record['stable'] = is_stable
+    return record
+
+class JsonlRecorder:
+    """Áp dụng cơ chế ổn định theo đúng thứ tự frame và ghi kết quả ra JSONL"""
+
+    def __init__(self, out, fps, catalog):
+        self.out = out
+        self.fps = fps
+        self.stabilizer = SignStabilizer()
+        self.catalog = catalog
+        self.frame_count = 0
+        self.event_count = 0
+
+    def record(self, frame_idx, detections):
+        video_time = frame_idx / self.fps
+        stable_flags, new_stable = self.stabilizer.update(detections, video_time)
+        self.out.write(json.dumps({
+            'type': 'frame',
+            'frame': frame_idx,
+            'time': round(video_time, 3),
+            'detections': [detection_to_json(det, flag)
+                           for det, flag in zip(detections, stable_flags)],
+        }, ensure_ascii=False) + "\n")
+        
+        for det in new_stable:
+            sign_info = self.catalog.get(det['cls_id'])
+            self.out.write(json.dumps({
+                'type': 'event',
+                'frame': frame_idx,
+                'time': round(video_time, 3),
+                'name': sign_info['name'],
+                'code': sign_info['code'],
+                **detection_to_json(det),
+            }, ensure_ascii=False) + "\n")
+            self.event_count += 1
+        self.frame_count += 1
+
+def read_batches(cap, batch_size, max_frames=None):
+    """Đọc frame từ video theo từng lô batch_size frame"""
+    batch = []
+    count = 0
+    while max_frames is None or count < max_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        batch.append(frame)
+        count += 1
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def run_headless(video_path, output_path=None, model_path=MODEL_PATH, batch_size=1, tiling=None,
+                 backend='torch', preprocess='ultralytics'):
+    """Chạy nhận diện trên video file không cần giao diện, ghi kết quả dạng JSONL
+    
+    Thời gian ổn định được tính theo thời gian của video (frame / fps) nên kết quả
+    không phụ thuộc tốc độ xử lý của máy. Với batch_size > 1, mỗi lần gọi mô hình
+    xử lý một lô frame, kết quả vẫn được ổn định lần lượt theo thứ tự frame.
+    """
+    model = load_inference_model(model_path, backend, preprocess=preprocess)
+    tiling = tiling or TiledInference()
+    
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        print(f"Không thể mở file video: {video_path}", file=sys.stderr)
+        return 1
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    
+    out = open(output_path, 'w', encoding='utf-8') if output_path else sys.stdout
+    recorder = JsonlRecorder(out, fps, SignCatalog(model.names))
+    start = time.perf_counter()
+    try:
+        for frames in read_batches(cap, batch_size):
+            for detections in tiling.predict(model, frames):
+                recorder.record(recorder.frame_count, detections)
+    finally:
+        cap.release()
+        if output_path:
+            out.close()
+    
+    elapsed = time.perf_counter() - start
+    print(f"Đã xử lý {recorder.frame_count} frame trong {elapsed:.1f}s "
+          f"({recorder.frame_count / elapsed if elapsed > 0 else 0:.1f} FPS, batch={batch_size}), "
+          f"{recorder.event_count} sự kiện biển báo ổn định", file=sys.stderr)
+    print(f"Nhận diện {tiling.summary()}", file=sys.stderr)
+    return 0
+
+def process_shard(task):
+    """Worker: nhận diện một đoạn frame [start_frame, end_frame) của video
+    
+    Mỗi tiến trình tự tải mô hình riêng và trả về detection thô của từng frame,
+    việc ổn định được thực hiện sau khi ghép các đoạn theo đúng thứ tự.
+    """
+    (video_path, model_path, start_frame, end_frame, batch_size, num_threads, tiling, backend,
+     preprocess) = task
+    import torch
+    torch.set_num_threads(num_threads)
+    
+    model = load_inference_model(model_path, backend, preprocess=preprocess)
+    cap = cv2.VideoCapture(video_path)
+    cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+    max_frames = None if end_frame is None else end_frame - start_frame
+    shard_detections = []
+    try:
+        for frames in read_batches(cap, batch_size, max_frames):
+            shard_detections.extend(tiling.predict(model, frames))
+    finally:
+        cap.release()
+    return start_frame, model.names, shard_detections
+
+def run_sharded(video_path, output_path=None, model_path=MODEL_PATH, batch_size=1, workers=None,
+                tiling=None, backend='torch', preprocess='ultralytics'):
+    """Chia video thành các đoạn frame và xử lý song song trên nhiều tiến trình
+    
+    Kết quả các đoạn được ghép lại thành một dòng thời gian duy nhất rồi mới áp dụng
+    cơ chế ổn định, nên một biển báo nằm vắt qua ranh giới hai đoạn vẫn được xử lý
+    giống hệt khi chạy tuần tự.
+    """
+    workers = workers or os.cpu_count() or 1
+    tiling = tiling or TiledInference()
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        print(f"Không thể mở file video: {video_path}", file=sys.stderr)
+        return 1
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    
+    if total_frames <= 0 or workers <= 1:
+        # Không biết số frame (hoặc chỉ 1 worker) thì không chia đoạn được
+        return run_headless(video_path, output_path, model_path, batch_size, tiling, backend,
+                            preprocess)
+    
+    # Chia nhỏ hơn số worker để cân bằng tải giữa các tiến trình
+    num_shards = min(total_frames, workers * 4)
+    bounds = [total_frames * i // num_shards for i in range(num_shards + 1)]
+    num_threads = max(1, (os.cpu_count() or 1) // workers)
+    if backend != 'torch':
+        # Export/lượng tử hóa một lần trước khi chia cho các worker
+        load_inference_model(model_path, backend)
+    tasks = []
+    for i in range(num_shards):
+        # Đoạn cuối đọc tới hết file vì CAP_PROP_FRAME_COUNT có thể không chính xác
+        end_frame = bounds[i + 1] if i < num_shards - 1 else None
+        tasks.append((video_path, model_path, bounds[i], end_frame, batch_size, num_threads, tiling,
+                      backend, preprocess))
+    
+    out = open(output_path, 'w', encoding='utf-8') if output_path else sys.stdout
+    recorder = None
+    start = time.perf_counter()
+    try:
+        ctx = multiprocessing.get_context('spawn')
+        with ctx.Pool(processes=workers) as pool:
+            # imap trả kết quả đúng thứ tự đoạn, ghép ngay khi đoạn kế tiếp xong
+            for start_frame, model_names, shard_detections in pool.imap(process_shard, tasks):
+                if recorder is None:
+                    # Tiến trình chính không tải mô hình, lấy danh sách lớp từ worker
+                    recorder = JsonlRecorder(out, fps, SignCatalog(model_names))
+                if start_frame != recorder.frame_count:
+                    print(f"Cảnh báo: đoạn bắt đầu ở frame {start_frame} nhưng dòng thời gian "
+                          f"đang ở frame {recorder.frame_count}", file=sys.stderr)
+                for offset, detections in enumerate(shard_detections):
+                    recorder.record(start_frame + offset, detections)
+    finally:
+        if output_path:
+            out.close()
+    
+    if recorder is None:
+        return 1
+    elapsed = time.perf_counter() - start
+    print(f"Đã xử lý {recorder.frame_count} frame trong {elapsed:.1f}s "
+          f"({recorder.frame_count / elapsed if elapsed > 0 else 0:.1f} FPS, "
+          f"{workers} tiến trình, {num_shards} đoạn), "
+          f"{recorder.event_count} sự kiện biển báo ổn định", file=sys.stderr)
+    return 0
+
+def compare_batch_sizes(video_path, batch_size, model_path=MODEL_PATH, max_frames=256, backend='torch',
+                        preprocess='ultralytics'):
+    """So sánh tốc độ suy luận giữa batch=1 và batch=batch_size
+    
+    Các frame được giải mã trước vào bộ nhớ để chỉ đo thời gian của mô hình.
+    """
+    model = load_inference_model(model_path, backend, preprocess=preprocess)
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        print(f"Không thể mở file video: {video_path}", file=sys.stderr)
+        return 1
+    frames = [frame for batch in read_batches(cap, max_frames, max_frames) for frame in batch]
+    cap.release()
+    if not frames:
+        print("Video không có frame nào", file=sys.stderr)
+        return 1
+    
+    # Chạy thử một lần để loại bỏ chi phí khởi tạo khỏi phép đo
+    predict_detections(model, frames[:1])
+    
+    throughput = {}
+    for size in sorted({1, batch_size}):
+        start = time.perf_counter()
+        for i in range(0, len(frames), size):
+            predict_detections(model, frames[i:i + size])
+        throughput[size] = len(frames) / (time.perf_counter() - start)
+        print(f"batch={size}: {throughput[size]:.1f} FPS ({len(frames)} frame)", file=sys.stderr)
+    
+    if batch_size != 1:
+        print(f"Tăng tốc batch={batch_size} so với batch=1: "
+              f"x{throughput[batch_size] / throughput[1]:.2f}", file=sys.stderr)
+    return 0
 
 def main():
+    parser = argparse.ArgumentParser(description="Nhận diện biển báo giao thông")
+    parser.add_argument('--headless', metavar='VIDEO',
+                        help="Xử lý video không cần giao diện, xuất kết quả JSONL")
+    parser.add_argument('--output', '-o', metavar='FILE',
+                        help="File JSONL đầu ra (mặc định: stdout)")
+    parser.add_argument('--model', default=MODEL_PATH,
+                        help=f"Đường dẫn mô hình YOLO (mặc định: {MODEL_PATH})")
+    parser.add_argument('--backend', choices=BACKENDS, default='torch',
+                        help="Backend suy luận (mặc định: torch); onnx/openvino được export tự động")
+    parser.add_argument('--preprocess', choices=PREPROCESS_MODES, default='ultralytics',
+                        help="Tiền xử lý: ultralytics (mặc định) hoặc buffers (bộ đệm letterbox dựng sẵn, "
+                             "không cấp phát mỗi frame; hỗ trợ torch/onnx)")
+    parser.add_argument('--compare-backends', action='store_true',
+                        help="So sánh độ trễ và độ trùng khớp của các backend trên dataset/train.zip rồi thoát")
+    parser.add_argument('--batch', type=int, default=1,
+                        help="Số frame mỗi lần gọi mô hình ở chế độ headless (mặc định: 1)")
+    parser.add_argument('--compare-batch', action='store_true',
+                        help="So sánh tốc độ giữa batch=1 và --batch rồi thoát")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Số tiến trình xử lý song song ở chế độ headless (0 = số lõi CPU)")
+    parser.add_argument('--watch-classes', action='store_true',
+                        help="Tự đọc lại classes_vie.txt/label.txt khi file thay đổi")
+    parser.add_argument('--roi', metavar='SPEC',
+                        help="Chỉ nhận diện trong vùng quan tâm: preset "
+                             f"({', '.join(ROI_PRESETS)}) hoặc 'x1,y1,x2,y2;...' theo tỉ lệ khung hình")
+    parser.add_argument('--tile', type=int, metavar='PIXELS',
+                        help="Chia frame thành các ô vuông cạnh PIXELS (chồng lấn) để nhận diện")
+    parser.add_argument('--tile-overlap', type=float, default=0.2,
+                        help="Tỉ lệ chồng lấn giữa các ô (mặc định: 0.2)")
+    parser.add_argument('--eval-recall', metavar='ZIP',
+                        help="Đo recall và MP/s trên tập ảnh có nhãn (vd: dataset/train.zip) rồi thoát")
+    parser.add_argument('--change-threshold', type=float, default=3.0,
+                        help="Sai khác tối thiểu (0-255) giữa 2 frame để chạy lại mô hình, 0 = luôn chạy")
+    parser.add_argument('--refresh-interval', type=float, default=2.0,
+                        help="Buộc chạy lại mô hình sau tối đa bấy nhiêu giây (mặc định: 2.0)")
+    parser.add_argument('--camera', default='0', metavar='SRC',
+                        help="Nguồn của nút camera: chỉ số camera hoặc URL rtsp://, http://... (mặc định: 0)")
+    parser.add_argument('--serve-mjpeg', metavar='VIDEO',
+                        help="Phát file video thành luồng MJPEG giả lập camera IP để thử nguồn URL")
+    parser.add_argument('--mjpeg-port', type=int, default=8554,
+                        help="Cổng cho --serve-mjpeg (mặc định: 8554)")
+    parser.add_argument('--streams', nargs='+', metavar='SRC',
+                        help="Chạy nhiều nguồn cùng lúc dạng lưới (số = chỉ số camera, còn lại = file video)")
+    parser.add_argument('--metrics-port', type=int, metavar='PORT',
+                        help="Bật metric và phục vụ dạng Prometheus tại http://127.0.0.1:PORT/metrics")
+    parser.add_argument('--hud', action='store_true',
+                        help="Vẽ FPS/độ trễ mô hình lên video")
+    parser.add_argument('--events-db', default=EVENTS_DB, metavar='FILE',
+                        help=f"File SQLite lưu sự kiện biển báo ổn định (mặc định: {EVENTS_DB})")
+    parser.add_argument('--no-events', action='store_true',
+                        help="Không lưu sự kiện biển báo")
+    parser.add_argument('--query-events', action='store_true',
+                        help="In các sự kiện đã lưu dạng JSONL rồi thoát (lọc bằng --code/--since/--until)")
+    parser.add_argument('--code', help="Mã biển báo cần lọc, vd: R415")
+    parser.add_argument('--since', help="Từ thời điểm (epoch giây hoặc ISO, vd: 2024-05-01T08:00)")
+    parser.add_argument('--until', help="Đến trước thời điểm (epoch giây hoặc ISO)")
+    args = parser.parse_args()
+    
+    if args.query_events:
+        sys.exit(query_events(args.events_db, args.code, args.since, args.until))
+    if args.serve_mjpeg:
+        sys.exit(serve_mjpeg(args.serve_mjpeg, args.mjpeg_port))
+    tiling = TiledInference.from_spec(args.roi, args.tile, args.tile_overlap)
+    if args.compare_backends:
+        sys.exit(compare_backends(args.model, args.eval_recall or DEFAULT_CALIBRATION_ZIP,
+                                  preprocess=args.preprocess))
+    if args.eval_recall:
+        sys.exit(compare_tiling(args.eval_recall, tiling, args.model, args.backend,
+                                args.preprocess))
+    if args.headless and args.compare_batch:
+        sys.exit(compare_batch_sizes(args.headless, max(1, args.batch), args.model,
+                                     backend=args.backend, preprocess=args.preprocess))
+    if args.headless and args.workers != 1:
+        sys.exit(run_sharded(args.headless, args.output, args.model, max(1, args.batch),
+                             args.workers or None, tiling, args.backend, args.preprocess))
+    if args.headless:
+        sys.exit(run_headless(args.headless, args.output, args.model, max(1, args.batch), tiling,
+                              args.backend, args.preprocess))
+    
+    metrics = MetricsRegistry(enabled=args.metrics_port is not None)
+    if args.metrics_port is not None:
+        metrics.serve(args.metrics_port)
+    
+    event_store = None if args.no_events else EventStore(args.events_db)
+    
     root = tk.Tk()
-    app = TrafficSignDetectionApp(root)
+    app = TrafficSignDetectionApp(root, watch_catalog=args.watch_classes, tiling=tiling,
+                                  change_detector=ChangeDetector(args.change_threshold,
+                                                                 args.refresh_interval),
+                                  model_path=args.model, backend=args.backend,
+                                  preprocess=args.preprocess, metrics=metrics, show_hud=args.hud,
+                                  streams=args.streams, camera_source=args.camera,
+                                  event_store=event_store)
     root.mainloop()
+    if event_store is not None:
+        event_store.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
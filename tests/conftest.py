@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Cho phép import main.py ở thư mục gốc khi chạy pytest từ bất kỳ đâu
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,33 @@
+import numpy as np
+
+import main
+from benchmark import BenchmarkApp, MockDetector, NullRoot
+from main import ChangeDetector, EngineResult
+
+
+class OneShotDetector(MockDetector):
+    """Chỉ lần gọi đầu trả về một biển báo (dương tính giả một lần), sau đó không thấy gì"""
+
+    def __call__(self, frames, **kwargs):
+        results = super().__call__(frames, **kwargs)
+        if self.calls > 1:
+            return [EngineResult(np.zeros((0, 6), dtype=np.float32)) for _ in frames]
+        return results
+
+
+def test_reused_detections_on_static_scene_do_not_confirm_a_sign(monkeypatch):
+    clock = {'now': 1.8e9}
+    monkeypatch.setattr(main.time, 'time', lambda: clock['now'])
+    app = BenchmarkApp(NullRoot(), OneShotDetector({0: '0'}, num_signs=1))
+    app.enable_sound = False
+    app.change_detector = ChangeDetector(threshold=3.0, refresh_interval=10.0)
+    frame = np.full((360, 640, 3), 100, dtype=np.uint8)
+
+    for _ in range(60):  # 2 giây cảnh tĩnh ở 30 fps
+        app.detect_traffic_signs(frame)
+        clock['now'] += 1 / 30
+
+    assert app.model.calls == 1
+    assert app.change_detector.skipped > 0
+    assert not app.stabilizer.stable_tracks
+    assert not app.detected_history
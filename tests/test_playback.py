@@ -0,0 +1,68 @@
+import statistics
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from main import DROP_LOSSLESS, VIDEO_PREFETCH_FRAMES, FramePipeline, PlaybackClock, StridedVideoReader
+
+
+class FakeVideo:
+    """Video file giả 30 fps: giải mã tức thì, thời điểm frame theo CAP_PROP_POS_MSEC"""
+
+    def __init__(self, fps=30.0, frames=600):
+        self.fps = fps
+        self.frames = frames
+        self.index = 0
+        self.image = np.zeros((36, 64, 3), dtype=np.uint8)
+
+    def grab(self):
+        if self.index >= self.frames:
+            return False
+        self.index += 1
+        return True
+
+    def read(self):
+        if not self.grab():
+            return False, None
+        return True, self.image
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_POS_MSEC:
+            return (self.index - 1) / self.fps * 1000
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        return 0.0
+
+
+def test_slow_inference_does_not_show_frames_far_behind_schedule():
+    fps, inference = 30.0, 0.125
+    clock = PlaybackClock(1.0, fps)
+    reader = StridedVideoReader(FakeVideo(fps), 1, clock)
+    lags = []
+    done = threading.Event()
+
+    def process(frame):
+        time.sleep(inference)
+        # Chuyển thời điểm trong video của frame sang tầng render để đo độ trễ
+        return frame, pipeline.current_media_time
+
+    def render(result):
+        _, media_time = result
+        lags.append(time.perf_counter() - clock.due_time(media_time))
+
+    pipeline = FramePipeline(read_frame=reader.read, process_frame=process, render_frame=render,
+                             drop_policy=DROP_LOSSLESS, queue_size=VIDEO_PREFETCH_FRAMES,
+                             clock=clock, frame_time=lambda: reader.position,
+                             on_finish=done.set)
+    pipeline.start()
+    time.sleep(2.0)
+    pipeline.stop()
+    done.wait(2.0)
+
+    # Frame đầu làm mốc; các frame sau chỉ trễ khoảng một lần nhận diện, không cộng dồn
+    # thời gian chờ trong hàng đợi prefetch
+    assert len(lags) >= 10
+    assert statistics.median(lags[1:]) < inference + 2 / fps
+    assert pipeline.get_stats()['dropped_late'] > 0
@@ -0,0 +1,106 @@
+import multiprocessing
+import socket
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+from main import LatestFrameGrabber, serve_mjpeg
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(condition, timeout=10.0):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+@pytest.fixture
+def video_path(tmp_path):
+    path = str(tmp_path / 'clip.avi')
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 30, (64, 48))
+    if not writer.isOpened():
+        pytest.skip("OpenCV không ghi được video MJPG")
+    for i in range(30):
+        writer.write(np.full((48, 64, 3), i * 8, dtype=np.uint8))
+    writer.release()
+    return path
+
+
+def start_server(video_path, port):
+    """Chạy serve_mjpeg ở tiến trình riêng, chờ tới khi cổng nhận kết nối"""
+    process = multiprocessing.get_context('spawn').Process(
+        target=serve_mjpeg, args=(video_path, port), daemon=True)
+    process.start()
+
+    def listening():
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return True
+        except OSError:
+            return False
+    assert wait_for(listening), "serve_mjpeg không khởi động"
+    return process
+
+
+def read_frames(grabber, count, timeout=10.0):
+    """Đọc count frame mới, không chặn quá timeout giây"""
+    frames = []
+    end = time.monotonic() + timeout
+    while len(frames) < count and time.monotonic() < end:
+        if grabber.frame_id > grabber.read_id:
+            ret, frame = grabber.read()
+            assert ret
+            frames.append(frame)
+        else:
+            time.sleep(0.005)
+    return frames
+
+
+def test_grabber_reads_and_reconnects_to_local_mjpeg_server(video_path):
+    port = free_port()
+    url = f'http://127.0.0.1:{port}/stream.mjpg'
+    statuses = []
+    server = start_server(video_path, port)
+    grabber = None
+    try:
+        started = time.monotonic()
+        grabber = LatestFrameGrabber(url, reconnect_delay=0.2,
+                                     on_status=lambda g, status: statuses.append(status)).start()
+        assert time.monotonic() - started < 0.5  # start() không chờ kết nối
+        assert grabber.isOpened()
+
+        frames = read_frames(grabber, 20)
+        assert len(frames) == 20
+        assert frames[0].shape == (48, 64, 3)
+        stats = grabber.get_stats()
+        assert stats['delivered'] == 20
+        assert stats['reconnects'] == 0
+        assert stats['connected']
+        assert statuses == ['connecting', 'connected']
+
+        # Máy chủ tắt: luồng đọc phát hiện mất kết nối rồi kết nối lại khi máy chủ chạy lại
+        server.terminate()
+        server.join()
+        assert wait_for(lambda: grabber.get_stats()['reconnects'] == 1)
+        assert not grabber.get_stats()['connected']
+        server = start_server(video_path, port)
+        assert len(read_frames(grabber, 5)) == 5
+        stats = grabber.get_stats()
+        assert stats['reconnects'] == 1
+        assert stats['connected']
+        assert statuses[:4] == ['connecting', 'connected', 'reconnecting', 'connected']
+    finally:
+        if grabber is not None:
+            grabber.release()
+        server.terminate()
+        server.join()
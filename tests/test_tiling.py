@@ -0,0 +1,52 @@
+import numpy as np
+
+from main import EngineResult, TiledInference, box_iou, merge_region_detections
+
+
+class BrightRegionModel:
+    """Mô hình giả: trả về hộp bao các pixel sáng của từng ảnh đưa vào (lớp 0)"""
+
+    names = {0: '0'}
+
+    def __call__(self, images, conf=None, **kwargs):
+        results = []
+        for image in images:
+            ys, xs = np.nonzero(image[:, :, 0] > 128)
+            if len(xs):
+                row = [[xs.min(), ys.min(), xs.max() + 1, ys.max() + 1, 0.9, 0]]
+            else:
+                row = []
+            results.append(EngineResult(np.array(row, dtype=np.float32).reshape(-1, 6)))
+        return results
+
+
+def make_detection(box, conf=0.9, cls_id=0):
+    return {'box': box, 'cls_id': cls_id, 'label': str(cls_id), 'conf': conf}
+
+
+def test_fragment_at_tile_seam_is_merged_into_full_box():
+    full = make_detection((600.0, 100.0, 700.0, 200.0), conf=0.8)
+    fragment = make_detection((600.0, 100.0, 640.0, 200.0), conf=0.9)
+    assert box_iou([full['box']], [fragment['box']])[0, 0] < 0.5  # NMS theo IoU giữ cả hai
+
+    merged = merge_region_detections([full, fragment])
+    assert len(merged) == 1
+    assert merged[0]['box'] == (600.0, 100.0, 700.0, 200.0)
+    assert merged[0]['conf'] == 0.9
+
+
+def test_merge_keeps_other_classes_and_separate_signs():
+    detections = [make_detection((600.0, 100.0, 700.0, 200.0)),
+                  make_detection((600.0, 100.0, 640.0, 200.0), cls_id=1),
+                  make_detection((800.0, 100.0, 900.0, 200.0))]
+    assert len(merge_region_detections(detections)) == 3
+
+
+def test_tiled_predict_reports_one_box_for_sign_on_seam():
+    frame = np.zeros((640, 1280, 3), dtype=np.uint8)
+    tiling = TiledInference(tile_size=640, overlap=0.2)
+    # Biển báo nằm ngang qua mép phải của ô đầu tiên (x = 640)
+    frame[100:200, 600:700] = 255
+    detections = tiling.predict(BrightRegionModel(), [frame])[0]
+    assert len(detections) == 1
+    assert detections[0]['box'] == (600.0, 100.0, 700.0, 200.0)
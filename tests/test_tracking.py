@@ -0,0 +1,51 @@
+import time
+
+import pytest
+
+from main import SignStabilizer, SignTracker
+
+EPOCH = 1.8e9  # Cỡ giá trị của time.time() mà giao diện truyền vào
+
+
+def make_detection(x, cls_id=0):
+    return {'box': (x, 100.0, x + 40.0, 140.0), 'cls_id': cls_id, 'label': str(cls_id), 'conf': 0.9}
+
+
+@pytest.mark.parametrize('start', [1000.0, EPOCH, time.time()])
+def test_predict_moves_box_with_epoch_timestamps(start):
+    tracker = SignTracker()
+    # Biển báo di chuyển 200 px/giây theo trục x
+    for i in range(5):
+        tracker.update([make_detection(200.0 + 20.0 * i)], start + 0.1 * i)
+    last_time = start + 0.4
+    (track_id,), boxes = tracker.predict(last_time + 0.2)
+    velocity = tracker.tracks[track_id]['velocity'][0]
+    assert velocity > 100.0
+    assert boxes[0][0] == pytest.approx(280.0 + velocity * 0.2, abs=0.5)
+
+    # Chỉ ngoại suy tối đa max_predict giây
+    _, clipped = tracker.predict(last_time + 10.0)
+    assert clipped[0][0] == pytest.approx(280.0 + velocity * tracker.max_predict, abs=0.5)
+
+
+def test_stabilizer_propagates_moving_boxes_between_inferences():
+    """Giống giao diện: chạy mô hình mỗi 3 frame (30 fps), các frame giữa dùng propagate"""
+    stabilizer = SignStabilizer()
+    start = time.time()
+    frame_time = 1 / 30
+    propagated_x = []
+    for i in range(12):
+        now = start + i * frame_time
+        if i % 3 == 0:
+            detections = [make_detection(200.0 + 200.0 * i * frame_time)]
+            stabilizer.update(detections, now)
+        else:
+            detections = stabilizer.propagate(now)
+            stabilizer.update(detections, now, propagated=True)
+            assert detections[0]['propagated']
+            propagated_x.append(detections[0]['box'][0])
+    # Sau khi có vận tốc, box nội suy phải tiến dần giữa 2 lần nhận diện
+    later = propagated_x[2:]
+    assert all(b > a for a, b in zip(later, later[1:]))
+    last_detected = 200.0 + 200.0 * 9 * frame_time
+    assert propagated_x[-1] > last_detected + 3.0